@@ -0,0 +1,137 @@
+import importlib.metadata
+import importlib.util
+import os
+import pathlib
+import sys
+import time
+from typing import Iterable
+
+import config
+import sqlite_store
+
+# 住所の解決方法(`postal_number.AddressIndex.resolve`)を変えたときに上げる版
+RESOLVER_VERSION = 2
+
+
+def _jusho_database_path() -> str | None:
+    """
+    jushoを読み込まずに、住所データベースファイルのパスを返す(見つからなければNone)。
+
+    `jusho.jusho.get_database_path` と同じ順に探します。jushoの読み込みには時間がかかるので、
+    住所の解決が必要になるまでは読み込まないようにするためです。
+    """
+    spec = importlib.util.find_spec("jusho")
+    if spec is None or spec.origin is None:
+        return None
+    package_dir = os.path.dirname(spec.origin)
+    candidates = [
+        os.path.join(package_dir, "data/address.db"),
+        os.path.join(sys.prefix, "data/address.db"),
+        os.path.join(package_dir.rsplit("lib", 1)[0], "data/address.db"),
+    ]
+    return next((path for path in candidates if os.path.exists(path)), None)
+
+
+def jusho_data_version() -> str:
+    """jushoのバージョンと住所データベースファイルから、データの版を表す文字列を返す"""
+    path = _jusho_database_path()
+    try:
+        version = importlib.metadata.version("jusho")
+    except importlib.metadata.PackageNotFoundError:
+        version = None
+    if path is None or version is None:
+        # 配置が想定と違う場合だけ、jushoを読み込んで調べる
+        import jusho
+        import jusho.jusho
+
+        path = jusho.jusho.get_database_path()
+        version = jusho.__version__
+    stat = os.stat(path)
+    return f"{version}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+class AddressCache(sqlite_store.SQLiteStore):
+    """正規化済みの住所から(都道府県, 市区町村, それ以降)への解決結果を保存する永続キャッシュ
+
+    - SQLiteのファイルに保存し、次回以降の実行でも再利用します。
+    - 件数が `max_entries` を超えた場合、最後に使われた時刻が古いものから削除します(LRU)。
+    - jushoのデータの版か住所の解決方法の版が変わった場合は、保存済みの内容を全て破棄します。
+
+    Args:
+        path (str | pathlib.Path): キャッシュファイルのパス
+        max_entries (int): 保持する最大件数
+        version (str | None): データの版。省略時は `jusho_data_version()` と `RESOLVER_VERSION` を使用
+    """
+
+    def __init__(
+        self,
+        path: str | pathlib.Path,
+        max_entries: int = config.ADDRESS_CACHE_MAX_ENTRIES,
+        version: str | None = None,
+    ):
+        super().__init__(path)
+        self.max_entries = max_entries
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS addresses (
+                address TEXT PRIMARY KEY,
+                prefecture TEXT,
+                city TEXT,
+                area TEXT,
+                used REAL
+            );
+            CREATE INDEX IF NOT EXISTS used_index ON addresses(used);
+            """
+        )
+        self._check_version(version or f"{jusho_data_version()}:{RESOLVER_VERSION}")
+        self.hits = 0
+        self.misses = 0
+
+    def _check_version(self, version: str):
+        row = self.conn.execute(
+            "SELECT value FROM meta WHERE key = 'version'"
+        ).fetchone()
+        if row is None or row[0] != version:
+            # データや解決方法の版が違えば解決結果も変わりうるので全て破棄する
+            with self.conn:
+                self.conn.execute("DELETE FROM addresses")
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('version', ?)", (version,)
+                )
+
+    def get_many(self, addresses: Iterable[str]) -> dict[str, tuple[str, str, str]]:
+        """キャッシュに存在する住所の解決結果を返し、最終使用時刻を更新する"""
+        addresses = list(addresses)
+        found: dict[str, tuple[str, str, str]] = {}
+        for chunk in sqlite_store.chunked(addresses):
+            rows = self.conn.execute(
+                "SELECT address, prefecture, city, area FROM addresses "
+                f"WHERE address IN ({sqlite_store.placeholders(chunk)})",
+                chunk,
+            ).fetchall()
+            for address, *resolved in rows:
+                found[address] = tuple(resolved)
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE addresses SET used = ? WHERE address = ?",
+                ((now, address) for address in found),
+            )
+        self.hits += len(found)
+        self.misses += len(addresses) - len(found)
+        return found
+
+    def put_many(self, resolved: dict[str, tuple[str, str, str]]):
+        """解決結果を保存し、上限を超えた分を古いものから削除する"""
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO addresses VALUES (?, ?, ?, ?, ?)",
+                ((address, *result, now) for address, result in resolved.items()),
+            )
+            self.conn.execute(
+                "DELETE FROM addresses WHERE address IN ("
+                "SELECT address FROM addresses ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
@@ -0,0 +1,217 @@
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import pathlib
+import platform
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import config
+import make_fake_list
+
+
+def generate_dataset(
+    rows: int, path: pathlib.Path, seed: int = 0, workers: int = 1
+) -> pathlib.Path:
+    """
+    ベンチマーク用の患者データをShift_JISのCSVとして作成する関数。
+
+    `make_fake_list.generate` で作成します。最終来院日は実行日の2年前から今日までに散らばるので、
+    実際の運用と同じく一部の行だけがリコールの期間に入ります。住所は一部に集中させ、
+    不正な日付・郵便番号も少し混ぜます。
+
+    Args:
+        rows (int): 行数
+        path (pathlib.Path): 出力先
+        seed (int, optional): 乱数のシード
+        workers (int, optional): 作成に使うプロセス数
+
+    Returns:
+        pathlib.Path: 作成したファイルのパス
+    """
+    return make_fake_list.generate(
+        rows,
+        path,
+        seed=seed,
+        workers=workers,
+        duplicate_ratio=0.3,
+        malformed_date_ratio=0.001,
+        malformed_postal_ratio=0.001,
+    )
+
+
+def generate_ng_list(dataset: pathlib.Path, path: pathlib.Path, ratio: float = 0.01):
+    """データのカルテ番号のうち `ratio` の割合を含むNGリストを作成する"""
+    ids = pd.read_csv(
+        dataset, encoding="shift_jis", usecols=[config.PATIENT_ID_COLUMN], dtype=str
+    )[config.PATIENT_ID_COLUMN]
+    ng = ids.sample(frac=ratio, random_state=0)
+    pd.DataFrame({"氏名": "", config.PATIENT_ID_COLUMN: ng}).to_csv(
+        path, index=False, encoding="shift_jis"
+    )
+
+
+def bench_stages(
+    dataset: pathlib.Path, ng_list_path: pathlib.Path, use_cache: bool = False
+) -> dict:
+    """
+    `main.run` でデータを処理し、`run_report.json` に記録された段階ごとの時間と行数、
+    最大常駐メモリの増分を返す関数。
+
+    実際の実行と同じ処理を計測するため、段階を個別に呼び出さずに `main.run` 全体を実行します。
+    入力データのキャッシュ・最終来院日の索引・郵送履歴は使わず、毎回CSVから読み込みます。
+    最大常駐メモリはプロセス全体の値なので、データの大きさごとに新しいプロセスで実行します。
+    """
+    # mainはconfigの値を参照するので、読み込む前にベンチマーク用の設定に差し替える
+    config.NG_LIST_PATH = str(ng_list_path)
+    config.EXPORT_CACHE_DIR = None
+    config.LAST_VISIT_INDEX_PATH = None
+    config.MAILING_HISTORY_PATH = None
+    if not use_cache:
+        config.ADDRESS_CACHE_PATH = None
+    import main
+
+    with tempfile.TemporaryDirectory() as output_root:
+        config.OUTPUT_DIR = output_root
+        with contextlib.redirect_stdout(io.StringIO()):
+            output_dir = main.run(dataset)
+        report = json.loads((output_dir / "run_report.json").read_text("utf-8"))
+
+    stages = {}
+    for name, stage in report["stages"].items():
+        seconds = stage["wall_seconds"]
+        stages[name] = {
+            "seconds": seconds,
+            "cpu_seconds": stage["cpu_seconds"],
+            "rows_in": stage["rows_in"],
+            "rows_out": stage["rows_out"],
+            "peak_memory_delta_mb": stage["peak_memory_delta_mb"],
+            "rows_per_second": stage["rows_in"] / seconds if seconds else None,
+        }
+    stages["run"] = {
+        "seconds": report["wall_seconds"],
+        "cpu_seconds": report["cpu_seconds"],
+        "rows_in": report["row_counts"].get("読み込み", 0),
+        "rows_out": None,
+        "peak_rss_mb": report["peak_rss_mb"],
+    }
+    return stages
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=pathlib.Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(
+    sizes: list[int],
+    data_dir: pathlib.Path,
+    seed: int = 0,
+    use_cache: bool = False,
+    workers: int = 1,
+) -> dict:
+    """データの大きさごとに `bench_stages` を実行し、結果をまとめて返す"""
+    data_dir.mkdir(parents=True, exist_ok=True)
+    results = []
+    for rows in sizes:
+        dataset = data_dir / f"bench_{rows}_{seed}.csv"
+        if not dataset.exists():
+            print(f"{rows}行のデータを作成しています...")
+            generate_dataset(rows, dataset, seed, workers)
+        ng_list_path = data_dir / f"bench_{rows}_{seed}_nglist.csv"
+        if not ng_list_path.exists():
+            generate_ng_list(dataset, ng_list_path)
+
+        print(f"{rows}行で計測しています...")
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            stages = executor.submit(
+                bench_stages, dataset, ng_list_path, use_cache
+            ).result()
+        results.append(
+            {
+                "rows": rows,
+                "wall_seconds": time.perf_counter() - start,
+                "stages": stages,
+            }
+        )
+        for name, stage in stages.items():
+            if name == "run":
+                print(
+                    f"  {'run':<26}{stage['seconds']:9.3f}s  "
+                    f"{stage['rows_in']:>9}行 peak {stage['peak_rss_mb'] or 0:8.1f}MB"
+                )
+                continue
+            print(
+                f"  {name:<26}{stage['seconds']:9.3f}s  "
+                f"{stage['rows_in']:>9}→{stage['rows_out']:<9} "
+                f"+{stage['peak_memory_delta_mb']:7.1f}MB"
+            )
+    return {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "seed": seed,
+        "address_cache": use_cache,
+        "results": results,
+    }
+
+
+def save_results(report: dict, path: pathlib.Path):
+    """結果をJSONファイルに追記する(ファイルには実行ごとの結果のリストを保存)"""
+    runs = json.loads(path.read_text(encoding="utf-8")) if path.exists() else []
+    runs.append(report)
+    path.write_text(json.dumps(runs, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="main.pyの実行を段階ごとに計測します")
+    parser.add_argument(
+        "--rows",
+        type=int,
+        nargs="+",
+        default=[10_000, 100_000, 1_000_000],
+        help="計測するデータの行数(複数指定可)",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="データ作成の乱数シード")
+    parser.add_argument(
+        "--data-dir",
+        type=pathlib.Path,
+        default=pathlib.Path(tempfile.gettempdir()) / "recall_post_bench",
+        help="作成したデータを置くフォルダ(同じ行数・シードなら再利用)",
+    )
+    parser.add_argument(
+        "--output",
+        type=pathlib.Path,
+        default=pathlib.Path("bench_results.json"),
+        help="結果を追記するJSONファイル",
+    )
+    parser.add_argument(
+        "--cache", action="store_true", help="住所解決キャッシュを使って計測する"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="データ作成に使うプロセス数"
+    )
+    args = parser.parse_args()
+
+    report = run_benchmark(
+        args.rows, args.data_dir, args.seed, args.cache, args.workers
+    )
+    save_results(report, args.output)
+    print(f"結果を{args.output}に保存しました")
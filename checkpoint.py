@@ -0,0 +1,141 @@
+import os
+import pathlib
+import pickle
+from typing import Iterable, Iterator, Optional
+
+import visit_index
+
+# 出力フォルダに保存する途中経過のファイル名
+FILENAME = "checkpoint.pkl"
+# チャンクごとの記録を追記していくファイル名
+JOURNAL_FILENAME = "checkpoint.journal"
+# 保存する内容を変えたときに、古い途中経過から再開しないようキーに含める版
+_FORMAT_VERSION = 2
+
+
+def run_key(
+    input_path: pathlib.Path,
+    periods: list[tuple],
+    chunksize: int,
+    ignore_history: bool,
+) -> str:
+    """
+    途中経過から再開してよいかの判定に使うキーを返す関数。
+
+    入力ファイル(パス・サイズ・更新日時、`visit_index.input_key`)、郵送ごとの成人・小児の期間、
+    チャンクの行数と郵送履歴の使い方が同じ場合だけ、同じキーになります。
+    ファイルの内容のハッシュは使わないので、大きなファイルでも処理の前に全体を読み込みません。
+    """
+    return repr(
+        (
+            _FORMAT_VERSION,
+            visit_index.input_key(input_path),
+            periods,
+            chunksize,
+            ignore_history,
+        )
+    )
+
+
+class Checkpoint:
+    """
+    `main.run_stream` の途中経過を出力フォルダに保存・読み込みするクラス。
+
+    チャンクを出力し終えるたびに、集計中の値と出力ファイルのサイズを保存します。
+    再開するときは出力ファイルを保存したサイズに切り詰めてから、続きのチャンクを追記するので、
+    書き込みの途中で止まった場合も、止まらずに実行した場合と同じ出力になります。
+    チャンクが増えるほど大きくなる記録(解決できなかった行など)は `append` でチャンクの分だけ
+    追記するので、チャンクごとに保存し直す量は増えません。
+
+    Args:
+        output_dir (pathlib.Path): 出力フォルダ
+        key (str): `run_key` で作ったキー
+    """
+
+    def __init__(self, output_dir: pathlib.Path, key: str):
+        self.path = output_dir / FILENAME
+        self.journal = output_dir / JOURNAL_FILENAME
+        self.key = key
+
+    def append(self, **record):
+        """チャンク1つ分の記録を追記する。`save` より前に呼ぶと、その `save` の途中経過に含まれる"""
+        with open(self.journal, "ab") as f:
+            pickle.dump(record, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def records(self) -> Iterator[dict]:
+        """`append` で追記した記録を順に返す"""
+        if not self.journal.exists():
+            return
+        with open(self.journal, "rb") as f:
+            while True:
+                try:
+                    yield pickle.load(f)
+                except EOFError:
+                    return
+
+    def save(self, files: Iterable[pathlib.Path], **state):
+        """
+        stateとfiles(と追記した記録)の現在のサイズを保存する。まだないファイルは、
+        再開時に削除するよう記録する。
+        書き込みの途中で止まっても壊れないよう、一時ファイルに書いてから置き換えます。
+        """
+        files = [*files, self.journal]
+        sizes = {str(p): p.stat().st_size if p.exists() else None for p in files}
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            pickle.dump(
+                {"key": self.key, "sizes": sizes, "state": state},
+                f,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        os.replace(tmp, self.path)
+
+    def load(self) -> Optional[dict]:
+        """キーが一致する途中経過があれば、出力ファイルを保存時のサイズに戻してstateを返す"""
+        try:
+            with open(self.path, "rb") as f:
+                saved = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            return None
+        if saved.get("key") != self.key:
+            return None
+        sizes = saved["sizes"]
+        if any(size is not None and not os.path.exists(p) for p, size in sizes.items()):
+            # 出力ファイルが消されていれば再開できない
+            return None
+        for path, size in sizes.items():
+            if size is None:
+                pathlib.Path(path).unlink(missing_ok=True)
+                continue
+            with open(path, "r+b") as f:
+                f.truncate(size)
+        return saved["state"]
+
+    def remove(self):
+        self.path.unlink(missing_ok=True)
+        self.journal.unlink(missing_ok=True)
+
+
+def find(
+    output_root: pathlib.Path, input_path: pathlib.Path, key: str
+) -> Optional[tuple[pathlib.Path, Checkpoint, dict]]:
+    """
+    `config.OUTPUT_DIR` の下から、同じ入力ファイルでキーが一致する途中経過を探す関数。
+
+    出力フォルダ名には実行日が入るので、日をまたいで再開する場合も見つかるよう、
+    入力ファイル名のフォルダを新しい順に確認します。
+
+    Returns:
+        Optional[tuple[pathlib.Path, Checkpoint, dict]]: 出力フォルダ、途中経過、保存したstate
+    """
+    candidates = sorted(
+        output_root.glob(f"*_{input_path.stem}/{FILENAME}"),
+        key=lambda p: p.stat().st_mtime_ns,
+        reverse=True,
+    )
+    for path in candidates:
+        saved = Checkpoint(path.parent, key)
+        state = saved.load()
+        if state is not None:
+            return path.parent, saved, state
+    return None
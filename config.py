@@ -26,9 +26,40 @@ NAME_HONORIFIC = "様"
 RECALL_INTERVAL_MONTHS = 6
 PED_RECALL_INTERVAL_MONTHS = 3
 
+### CSVの読み込み方法("pyarrow"にするとpyarrowがインストールされていればpyarrowで読み込みます)
+CSV_ENGINE = "c"
+
 ### 出力先フォルダ
 OUTPUT_DIR = "result"
 
+### --stream指定時に一度に読み込む行数
+STREAM_CHUNK_SIZE = 100000
+
+### 住所解決キャッシュのファイルパス(Noneにするとキャッシュを使いません)
+ADDRESS_CACHE_PATH = OUTPUT_DIR + "/address_cache.sqlite3"
+### 住所解決キャッシュの最大件数---超えた分は最後に使われたのが古いものから削除
+ADDRESS_CACHE_MAX_ENTRIES = 500000
+### 最終来院日の索引の保存先(Noneにすると保存しません)---同じ入力ファイルの2回目以降の実行で再利用
+LAST_VISIT_INDEX_PATH = OUTPUT_DIR + "/last_visit_index.npz"
+### 郵便番号→住所の表の保存先(Noneにすると保存せず、毎回jushoから作ります)
+ZIP_TABLE_PATH = OUTPUT_DIR + "/zip_table.pkl"
+### 読み込んだ入力データのキャッシュの保存先(Noneにするとキャッシュを使いません)
+EXPORT_CACHE_DIR = OUTPUT_DIR + "/export_cache"
+### 入力データのキャッシュの最大ファイル数---超えた分は最後に使われたのが古いものから削除
+EXPORT_CACHE_MAX_FILES = 5
+### --streamでは、この大きさ(バイト)以下の入力ファイルだけ読み込んだデータのキャッシュを使い・保存
+EXPORT_CACHE_STREAM_MAX_BYTES = 50 * 1024 * 1024
+### 郵送履歴の保存先(Noneにすると履歴を使わず、郵送済みの患者も毎回出力します)
+MAILING_HISTORY_PATH = OUTPUT_DIR + "/mailing_history.sqlite3"
+
+### 住所を解決できなかった行(rejects.csvに書き出す行)を、理由ごとに画面に表示する件数
+REJECT_LOG_EXAMPLES = 5
+
+### watcher.pyでフォルダを確認する間隔(秒)
+WATCH_POLL_SECONDS = 5
+### watcher.pyで同時に処理するファイル数(常駐するワーカープロセス数)
+WATCH_MAX_JOBS = 1
+
 
 ### 参考:ノーザで全項目CSV出力した際のコラム名一覧
 """
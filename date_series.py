@@ -0,0 +1,81 @@
+import datetime
+from typing import Sequence
+
+import numpy as np
+import pandas as pd
+from pandas.api.extensions import take
+
+# 全角数字を半角にし、日付に使う文字以外(空白など)を取り除くための変換表
+_DATE_TRANSLATION = str.maketrans("０１２３４５６７８９", "0123456789")
+
+
+def zenkaku_to_datetime_series(zenkaku_dates: pd.Series) -> pd.Series:
+    """全角の日付の列をまとめてdatetime64の列に変換する
+
+    同じ日付は一度だけ変換するため、ユニークな値に分解してから変換し、元の並びに戻します。
+    空欄や解釈できない値はエラーにせずNaTにします。
+
+    Args:
+        zenkaku_dates (pd.Series): 「２０２４年 ０１月 ０１日」のような日付の列
+
+    Returns:
+        pd.Series: datetime64型の列(インデックスと名前は入力と同じ)
+    """
+    codes, uniques = pd.factorize(zenkaku_dates)
+    hankaku_dates = (
+        pd.Series(uniques, dtype=object)
+        .astype(str)
+        .str.translate(_DATE_TRANSLATION)
+        .str.replace(r"[^0-9年月日]", "", regex=True)
+    )
+    parsed = pd.to_datetime(hankaku_dates, format="%Y年%m月%d日", errors="coerce")
+    return pd.Series(
+        take(parsed.to_numpy(), codes, allow_fill=True),
+        index=zenkaku_dates.index,
+        name=zenkaku_dates.name,
+    )
+
+
+def age_bands(
+    birthdays: pd.Series,
+    thresholds: Sequence[int],
+    references: Sequence[datetime.date],
+) -> np.ndarray:
+    """生年月日の列から、基準日ごとの満年齢の区分をまとめて求める
+
+    生年月日の年・月日は一度だけ取り出し、基準日ごとの年齢と区分の計算は配列のまま行います。
+    区分 i は ``thresholds[i - 1] <= 年齢 < thresholds[i]`` の範囲で、例えば
+    ``thresholds=[12, 65]`` なら 0: 12歳未満、1: 12歳以上65歳未満、2: 65歳以上 になります。
+
+    Args:
+        birthdays (pd.Series): datetime64型の生年月日の列
+        thresholds (Sequence[int]): 区分の境目の年齢(昇順)
+        references (Sequence[datetime.date]): 年齢を数える基準日
+
+    Returns:
+        np.ndarray: (基準日の数, 行数)の整数の配列。生年月日が不正(NaT)な行は-1
+
+    Example:
+        >>> birthdays = pd.Series(pd.to_datetime(["2014-10-18", "2014-10-17", None]))
+        >>> age_bands(birthdays, [12], [datetime.date(2026, 10, 17)]).tolist()
+        [[0, 1, -1]]
+    """
+    days = birthdays.to_numpy(dtype="datetime64[D]")
+    invalid = np.isnat(days)
+    years = days.astype("datetime64[Y]")
+    months = days.astype("datetime64[M]")
+    year = years.astype(np.int64) + 1970
+    # 月日を「月 * 100 + 日」の整数にして、基準日の月日と大小を比べる
+    month = (months - years).astype(np.int64) + 1
+    day = (days - months).astype(np.int64) + 1
+    month_day = month * 100 + day
+
+    bands = np.empty((len(references), len(days)), dtype=np.int64)
+    for i, reference in enumerate(references):
+        # 誕生日がまだ来ていなければ1歳引く
+        age = (
+            reference.year - year - (reference.month * 100 + reference.day < month_day)
+        )
+        bands[i] = np.searchsorted(thresholds, age, side="right")
+    bands[:, invalid] = -1
+    return bands
@@ -0,0 +1,168 @@
+import hashlib
+import os
+import pathlib
+import pickle
+from typing import Optional
+
+import pandas as pd
+
+import config
+
+# 保存する内容(変換済みの列など)を変えたときに、古いキャッシュを使わないようキーに含める版
+_FORMAT_VERSION = 2
+
+
+# 入力ファイル(パス・サイズ・更新日時)からキャッシュのキーを引く表のファイル名
+_INDEX_FILENAME = "index.pkl"
+
+
+def _settings() -> tuple:
+    """変換に関わる列名の設定"""
+    return (
+        _FORMAT_VERSION,
+        config.NAME_COLUMN,
+        config.PATIENT_ID_COLUMN,
+        config.POSTAL_CODE_COLUMN,
+        config.ADDRESS_COLUMN,
+        config.BIRTHDAY_COLUMN,
+        config.LAST_VISIT_COLUMN,
+    )
+
+
+def cache_key(input_path: str | pathlib.Path) -> str:
+    """入力ファイルの内容と、変換に関わる列名の設定から決まるキャッシュのキーを返す"""
+    digest = hashlib.sha256()
+    with open(input_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    digest.update(repr(_settings()).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _stat_key(input_path: str | pathlib.Path) -> str:
+    """入力ファイルのパス・サイズ・更新日時と列名の設定から決まる文字列"""
+    stat = os.stat(input_path)
+    return (
+        f"{pathlib.Path(input_path).resolve()}:{stat.st_size}:{stat.st_mtime_ns}:"
+        f"{_settings()!r}"
+    )
+
+
+def _parquet_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class ExportCache:
+    """
+    読み込み・変換済みの入力データを、入力ファイルの内容ごとに保存するキャッシュ。
+
+    同じファイルで再実行する場合(NGリストを直した後やnext_flagを変えた場合など)に、
+    Shift_JISのCSVの読み込みと日付・郵便番号の変換を省略します。pyarrowがインストール
+    されていればParquet形式で保存してメモリマップで読み込み、なければpickleで保存します。
+    ファイル数が `max_files` を超えた場合は、最後に使われたのが古いものから削除します。
+    保存したファイルのパス・サイズ・更新日時も覚えておくので(`find`)、同じファイルであれば
+    内容のハッシュ(`cache_key`)を求め直さずにキャッシュを引けます。
+
+    Args:
+        directory (str | pathlib.Path): 保存先のフォルダ
+        max_files (int): 保持するファイル数
+    """
+
+    def __init__(
+        self,
+        directory: str | pathlib.Path = config.EXPORT_CACHE_DIR,
+        max_files: int = config.EXPORT_CACHE_MAX_FILES,
+    ):
+        self.directory = pathlib.Path(directory)
+        self.max_files = max_files
+
+    def _paths(self, key: str) -> list[pathlib.Path]:
+        return [self.directory / f"{key}.parquet", self.directory / f"{key}.pkl"]
+
+    def _load_index(self) -> dict[str, str]:
+        try:
+            with open(self.directory / _INDEX_FILENAME, "rb") as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return {}
+
+    def find(self, input_path: str | pathlib.Path) -> Optional[str]:
+        """`remember` したときと同じ入力ファイル(パス・サイズ・更新日時)であればキーを返す"""
+        key = self._load_index().get(_stat_key(input_path))
+        if key is None or not any(p.exists() for p in self._paths(key)):
+            return None
+        return key
+
+    def _save_index(self, index: dict[str, str]):
+        """キャッシュのファイルが残っているキーだけを残して、表を保存する"""
+        index = {
+            stat_key: key
+            for stat_key, key in index.items()
+            if any(p.exists() for p in self._paths(key))
+        }
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / _INDEX_FILENAME
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    def remember(self, input_path: str | pathlib.Path, key: str):
+        """入力ファイルのパス・サイズ・更新日時とキーの組を覚えておく(消えたキャッシュの分は削除)"""
+        index = self._load_index()
+        index[_stat_key(input_path)] = key
+        self._save_index(index)
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        """保存したデータを返す。保存されていない、または読み込めない場合はNone"""
+        for path in self._paths(key):
+            if not path.exists():
+                continue
+            try:
+                if path.suffix == ".parquet":
+                    df = pd.read_parquet(path, memory_map=True)
+                else:
+                    with open(path, "rb") as f:
+                        df = pickle.load(f)
+            except Exception:
+                # 壊れたファイルやpyarrowがなくなった場合は、読み込み直して保存し直す
+                continue
+            path.touch()
+            return df
+        return None
+
+    def put(self, key: str, df: pd.DataFrame):
+        """データを保存し、上限を超えた分を古いものから削除する"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        parquet, pkl = self._paths(key)
+        saved = False
+        if _parquet_available():
+            try:
+                df.to_parquet(parquet)
+                saved = True
+            except Exception:
+                # 数値と文字列が混ざった列などParquetにできない場合はpickleで保存する
+                parquet.unlink(missing_ok=True)
+        if not saved:
+            with open(pkl, "wb") as f:
+                pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        files = sorted(
+            (
+                p
+                for p in self.directory.iterdir()
+                if p.suffix in (".parquet", ".pkl") and p.name != _INDEX_FILENAME
+            ),
+            key=lambda p: p.stat().st_mtime_ns,
+            reverse=True,
+        )
+        evicted = files[self.max_files :]
+        for path in evicted:
+            path.unlink(missing_ok=True)
+        if evicted:
+            # 削除したキャッシュを指す組を表から除く
+            self._save_index(self._load_index())
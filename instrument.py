@@ -0,0 +1,220 @@
+import cProfile
+import datetime
+import functools
+import json
+import os
+import pathlib
+import re
+import subprocess
+import sys
+import time
+from typing import Callable, Iterable, Optional
+
+try:
+    import resource
+except ImportError:  # Windowsにはresourceモジュールがない
+    resource = None
+
+# プロファイルを取る段階を指定する環境変数(カンマ区切り、allで全段階)
+PROFILE_ENV = "RECALL_POST_PROFILE"
+
+
+def peak_rss_mb() -> Optional[float]:
+    """プロセスの最大常駐メモリ(MB)。取得できない環境ではNone"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linuxはキロバイト、macOSはバイト単位
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def _count_rows(values: Iterable) -> Optional[int]:
+    # 計測する段階はpandasを読み込んだ後に呼ばれるので、起動時には読み込まない
+    import pandas as pd
+
+    frames = [v for v in values if isinstance(v, (pd.DataFrame, pd.Series))]
+    return sum(len(f) for f in frames) if frames else None
+
+
+class RunReport:
+    """
+    1回の実行の段階ごとの計測結果を集めるクラス。
+
+    `stage` で包んだ関数が呼ばれるたびに、経過時間・CPU時間・入出力の行数・最大常駐メモリの
+    増分を段階ごとに加算します。`profile` に含まれる段階はプロファイラ(pyinstrumentが
+    あればpyinstrument、なければcProfile)でも計測します。
+
+    Args:
+        profile (Iterable[str]): プロファイルを取る段階名("all"で全段階)
+    """
+
+    def __init__(self, profile: Iterable[str] = ()):
+        self.profile = set(profile)
+        self.stages: dict[str, dict] = {}
+        self.profilers: dict[str, object] = {}
+        # プロファイラは入れ子にできないので、計測中の段階の内側の段階では使わない
+        self._profiling = False
+        self.started_at = datetime.datetime.now()
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.process_time()
+
+    def _profiler(self, name: str):
+        if self._profiling or not ({name, "all"} & self.profile):
+            return None
+        if name not in self.profilers:
+            # pyinstrumentはプロファイルを取る場合だけ読み込む
+            try:
+                import pyinstrument
+
+                self.profilers[name] = pyinstrument.Profiler()
+            except ImportError:
+                self.profilers[name] = cProfile.Profile()
+        return self.profilers[name]
+
+    def record(self, name: str, func: Callable, args: tuple, kwargs: dict):
+        stage = self.stages.setdefault(
+            name,
+            {
+                "calls": 0,
+                "wall_seconds": 0.0,
+                "cpu_seconds": 0.0,
+                "rows_in": 0,
+                "rows_out": 0,
+                "peak_memory_delta_mb": 0.0,
+            },
+        )
+        profiler = self._profiler(name)
+        peak_before = peak_rss_mb()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        if profiler is not None:
+            self._profiling = True
+            if isinstance(profiler, cProfile.Profile):
+                profiler.enable()
+            else:
+                profiler.start()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            if profiler is not None:
+                if isinstance(profiler, cProfile.Profile):
+                    profiler.disable()
+                else:
+                    profiler.stop()
+                self._profiling = False
+            stage["calls"] += 1
+            stage["wall_seconds"] += time.perf_counter() - wall_start
+            stage["cpu_seconds"] += time.process_time() - cpu_start
+            if peak_before is not None:
+                stage["peak_memory_delta_mb"] += peak_rss_mb() - peak_before
+
+        rows_in = _count_rows(args)
+        outputs = result if isinstance(result, tuple) else (result,)
+        rows_out = _count_rows(outputs)
+        stage["rows_in"] += rows_in if rows_in is not None else rows_out or 0
+        stage["rows_out"] += rows_out if rows_out is not None else rows_in or 0
+        return result
+
+    def save(self, output_dir: pathlib.Path, **extra) -> pathlib.Path:
+        """`run_report.json` とプロファイル結果を output_dir に書き出す"""
+        profiles = []
+        for name, profiler in self.profilers.items():
+            if isinstance(profiler, cProfile.Profile):
+                path = output_dir / f"profile_{name}.prof"
+                profiler.dump_stats(path)
+            else:
+                path = output_dir / f"profile_{name}.html"
+                path.write_text(profiler.output_html(), encoding="utf-8")
+            profiles.append(path.name)
+
+        report = {
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "wall_seconds": time.perf_counter() - self._wall_start,
+            "cpu_seconds": time.process_time() - self._cpu_start,
+            "peak_rss_mb": peak_rss_mb(),
+            **extra,
+            "stages": self.stages,
+            "profiles": profiles,
+        }
+        path = output_dir / "run_report.json"
+        path.write_text(
+            json.dumps(report, ensure_ascii=False, indent=2, default=str),
+            encoding="utf-8",
+        )
+        return path
+
+
+# 計測中のレポート(計測していないときはNone)
+_report: Optional[RunReport] = None
+
+
+def start(profile: Iterable[str] = ()) -> RunReport:
+    """計測を開始する。profileを省略した場合は環境変数 `RECALL_POST_PROFILE` を使う"""
+    global _report
+    if not profile:
+        profile = [s for s in os.environ.get(PROFILE_ENV, "").split(",") if s]
+    _report = RunReport(profile)
+    return _report
+
+
+def stop():
+    global _report
+    _report = None
+
+
+def import_costs(modules: Iterable[str]) -> list[dict]:
+    """
+    新しいPythonのプロセスで `modules` を順に読み込み、モジュールごとの読み込み時間を返す関数。
+
+    `python -X importtime` の出力を集計します。先に読み込んだモジュールが使ったものは
+    読み込み済みになるので、後のモジュールの時間にはそれ以外の分だけが含まれます。
+
+    Returns:
+        list[dict]: 読み込み順の module, depth(入れ子の深さ), self_ms, cumulative_ms
+    """
+    statement = "; ".join(f"import {module}" for module in modules)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        capture_output=True,
+        text=True,
+        cwd=pathlib.Path(__file__).parent,
+    )
+    costs = []
+    for line in proc.stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)", line)
+        if match:
+            costs.append(
+                {
+                    "module": match[4],
+                    "depth": (len(match[3]) - 1) // 2,
+                    "self_ms": int(match[1]) / 1000,
+                    "cumulative_ms": int(match[2]) / 1000,
+                }
+            )
+    return costs
+
+
+def print_import_costs(costs: list[dict], modules: Iterable[str], top: int = 20):
+    """`import_costs` の結果を、modulesごとの合計と時間のかかったモジュール順に表示する"""
+    modules = set(modules)
+    for cost in costs:
+        if cost["depth"] == 0 and cost["module"] in modules:
+            print(f"[読み込み] {cost['module']}: {cost['cumulative_ms']:.1f}ms")
+    print(f"時間のかかったモジュール(上位{top}件、括弧内は依存先を含む時間)")
+    for cost in sorted(costs, key=lambda c: c["self_ms"], reverse=True)[:top]:
+        print(
+            f"  {cost['module']:<40}{cost['self_ms']:8.1f}ms"
+            f" ({cost['cumulative_ms']:.1f}ms)"
+        )
+
+
+def stage(func: Callable) -> Callable:
+    """計測中であれば、関数の呼び出しを関数名の段階として記録するデコレータ"""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _report is None:
+            return func(*args, **kwargs)
+        return _report.record(func.__name__, func, args, kwargs)
+
+    return wrapper
@@ -1,8 +1,11 @@
 import tkinter as tk
 from tkinter import filedialog
 from tkinter import messagebox
-import subprocess
+from tkinter import ttk
 import os
+import pathlib
+import queue
+import threading
 import config
 import datetimeutil
 import datetime
@@ -15,10 +18,93 @@ def get_period(option: str):
     return start.strftime("%Y/%m/%d") + "~" + end.strftime("%d")
 
 
+def count_data_rows(file_path: str | pathlib.Path) -> int:
+    """進捗表示の目安にする、ファイルのデータ行数(改行の数から見出し行を除いたもの)"""
+    rows = 0
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            rows += block.count(b"\n")
+    return max(rows - 1, 0)
+
+
+class PipelineWorker:
+    """
+    main.pyの処理を1本の作業スレッドで順に実行するクラス。
+
+    jushoの住所データベース(SQLite)は開いたスレッドでしか使えないので、main.pyの読み込みから
+    処理の実行までを全て同じスレッドで行います。起動直後に読み込みと住所索引の構築を済ませて
+    おき、同じ画面で続けて選んだファイルでは住所索引・NGリスト・住所解決キャッシュを再利用します。
+    進捗と結果は `events` に (種類, 値) の組で入れるので、GUI側で取り出して表示してください。
+    """
+
+    def __init__(self):
+        self.events: queue.Queue = queue.Queue()
+        self.cancel = threading.Event()
+        self._jobs: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def submit(
+        self,
+        file_path: str,
+        next_flag: int,
+        ignore_history: bool = False,
+        record_history: bool = False,
+    ):
+        self.cancel.clear()
+        self._jobs.put((file_path, next_flag, ignore_history, record_history))
+
+    def _loop(self):
+        # main.pyの読み込みと住所索引・郵便番号の表の準備は時間がかかるので、
+        # ファイルを選んでいる間に済ませる
+        try:
+            import main
+            import postal_number
+
+            import zip_table
+
+            postal_number.get_address_index()
+            zip_table.get_table()
+        except BaseException as e:
+            # 準備に失敗した場合は、以降のファイルの実行ごとにエラーを伝える
+            while True:
+                self._jobs.get()
+                self.events.put(("error", e))
+        while True:
+            self._run(main, *self._jobs.get())
+
+    def _run(
+        self,
+        main,
+        file_path: str,
+        next_flag: int,
+        ignore_history: bool,
+        record_history: bool,
+    ):
+        try:
+            self.events.put(("total", count_data_rows(file_path)))
+            output_dir = main.run_stream(
+                pathlib.Path(file_path),
+                next_flag,
+                progress=lambda rows: self.events.put(("progress", rows)),
+                cancel=self.cancel,
+                ignore_history=ignore_history,
+                record_history=record_history,
+                # 前回ランチャーが途中で終了していれば、その続きから処理する
+                resume=True,
+            )
+            self.events.put(("done", output_dir))
+        except main.RunCancelled:
+            self.events.put(("cancelled", None))
+        except BaseException as e:  # どのような失敗でもGUIに伝える
+            self.events.put(("error", e))
+
+
 def show_option_menu():
     # Tkinterのルートウィンドウを作成
     root = tk.Tk()
     root.title("Select Option")
+    worker = PipelineWorker()
 
     # プルダウンメニューの選択肢
     options = [-1, 0, 1]
@@ -36,11 +122,28 @@ def show_option_menu():
     )
     selected_label.pack(pady=10)
 
+    # 郵送履歴の使い方
+    ignore_history = tk.BooleanVar(root, False)
+    tk.Checkbutton(
+        root, text="送付済みの患者も出力する", variable=ignore_history
+    ).pack()
+    record_history = tk.BooleanVar(root, False)
+    record_checkbutton = tk.Checkbutton(
+        root, text="出力した患者を送付済みとして記録する", variable=record_history
+    )
+    record_checkbutton.pack()
+
     # 選択肢が変更された時に表示を更新する
+    # 0以外は先の郵送分の確認用なので、送付済みとしては記録しない
     def update_label(*args):
         selected_label.config(
             text=f"選択範囲: {get_period(selected_option.get())}",
         )
+        if int(selected_option.get()) == 0:
+            record_checkbutton.config(state=tk.NORMAL)
+        else:
+            record_history.set(False)
+            record_checkbutton.config(state=tk.DISABLED)
 
     selected_option.trace("w", update_label)
 
@@ -57,7 +160,16 @@ def show_option_menu():
         # 選択されたファイルのパスを表示
         if file_path:
             print(f"Selected file: {file_path}")
-            run_python_script(file_path, selected_option.get(), root)
+            execute_button.config(state=tk.DISABLED)
+            cancel_button.config(state=tk.NORMAL)
+            progress_bar.config(value=0)
+            status_label.config(text="準備中...")
+            worker.submit(
+                file_path,
+                int(selected_option.get()),
+                ignore_history.get(),
+                record_history.get(),
+            )
         else:
             print("No file selected.")
 
@@ -67,21 +179,48 @@ def show_option_menu():
     )
     execute_button.pack(pady=10)
 
+    # 進捗バーと中止ボタン
+    progress_bar = ttk.Progressbar(root, length=300, mode="determinate")
+    progress_bar.pack(padx=10, pady=5)
+    status_label = tk.Label(root, text="")
+    status_label.pack(pady=5)
+    cancel_button = tk.Button(
+        root, text="Cancel", state=tk.DISABLED, command=worker.cancel.set
+    )
+    cancel_button.pack(pady=10)
+
+    # 作業スレッドからの進捗と結果を定期的に取り出して表示する
+    total_rows = tk.IntVar(root, 0)
+
+    def poll_events():
+        while not worker.events.empty():
+            kind, value = worker.events.get()
+            if kind == "total":
+                total_rows.set(value)
+                progress_bar.config(maximum=max(value, 1))
+            elif kind == "progress":
+                progress_bar.config(value=value)
+                status_label.config(text=f"{value}/{total_rows.get()}行")
+            else:
+                execute_button.config(state=tk.NORMAL)
+                cancel_button.config(state=tk.DISABLED)
+                status_label.config(text="")
+                if kind == "done":
+                    progress_bar.config(value=progress_bar["maximum"])
+                    messagebox.showinfo(
+                        "Success", f"Python script executed successfully.\n{value}"
+                    )
+                elif kind == "cancelled":
+                    progress_bar.config(value=0)
+                    messagebox.showinfo("Cancelled", "処理を中止しました。")
+                else:
+                    messagebox.showerror("Error", f"Error executing script: {value}")
+        root.after(100, poll_events)
+
+    poll_events()
     root.mainloop()
 
 
-def run_python_script(file_path, selected_option, root):
-    # 'python main.py {fullpath} {selected_option}' を実行
-    command = ["python", "main.py", file_path, selected_option]
-
-    try:
-        # プロセスを実行
-        subprocess.run(command, check=True)
-        messagebox.showinfo("Success", "Python script executed successfully.")
-    except subprocess.CalledProcessError as e:
-        messagebox.showerror("Error", f"Error executing script: {e}")
-    root.quit()
-
-
 # 実行
-show_option_menu()
+if __name__ == "__main__":
+    show_option_menu()
@@ -0,0 +1,73 @@
+import datetime
+import pathlib
+import time
+from typing import Iterable
+
+import pandas as pd
+
+import config
+import ng_list
+import sqlite_store
+
+
+def cycle_name(kind: str, start: datetime.datetime) -> str:
+    """郵送の回を表す文字列。kindは"adult"か"ped"、startは最終来院日の期間の開始日"""
+    return f"{kind}:{start.strftime('%Y-%m-%d')}"
+
+
+class MailingHistory(sqlite_store.SQLiteStore):
+    """
+    郵送した患者を、カルテ番号と郵送の回ごとに記録するクラス。
+
+    郵送の回は最終来院日の期間(成人・小児別)で表します。期間は上旬・中旬・下旬で
+    区切られているので、next_flagを変えた実行どうしで期間が重なる場合は同じ回になり、
+    2回目の実行ではすでに郵送した患者を除外できます。
+    カルテ番号は `ng_list.normalize_ids` で正規化して保存します。
+    記録はSQLiteのファイルに(回, カルテ番号)の順の主キーで保存するので、何年分たまっても
+    今回の回の分だけを索引から取り出せます。
+
+    Args:
+        path (str | pathlib.Path): 記録を保存するファイルのパス
+    """
+
+    def __init__(self, path: str | pathlib.Path = config.MAILING_HISTORY_PATH):
+        super().__init__(path)
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS history (
+                cycle TEXT,
+                patient_id TEXT,
+                sent REAL,
+                PRIMARY KEY (cycle, patient_id)
+            ) WITHOUT ROWID
+            """
+        )
+
+    def sent_ids(self, cycles: Iterable[str]) -> pd.Index:
+        """いずれかの回で郵送済みのカルテ番号(正規化済み)を返す"""
+        cycles = list(dict.fromkeys(cycles))
+        ids = []
+        for chunk in sqlite_store.chunked(cycles):
+            ids += [
+                row[0]
+                for row in self.conn.execute(
+                    "SELECT patient_id FROM history "
+                    f"WHERE cycle IN ({sqlite_store.placeholders(chunk)})",
+                    chunk,
+                )
+            ]
+        return pd.Index(ids, dtype="string").unique()
+
+    def contains(self, ids: pd.Series, cycles: Iterable[str]) -> pd.Series:
+        """カルテ番号の列のうち、いずれかの回で郵送済みのものをTrueとする列を返す"""
+        return ng_list.normalize_ids(ids).isin(self.sent_ids(cycles))
+
+    def record(self, ids: pd.Series, cycle: str):
+        """カルテ番号の列を、cycleの回に郵送したものとして記録する"""
+        now = time.time()
+        normalized = ng_list.normalize_ids(ids).dropna().unique()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO history VALUES (?, ?, ?)",
+                ((cycle, i, now) for i in normalized),
+            )
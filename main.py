@@ -1,14 +1,127 @@
 # -*- coding: utf-8 -*-
 
-import sys
+import argparse
+import codecs
+import csv
+import datetime
+import io
+import os
 import pathlib
 import re
+import threading
+import config
+import instrument
+from typing import Callable, Iterable, Iterator, Optional
+
+
+def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="レセコンの患者データをwebゆうびん向けのCSVに変換します"
+    )
+    parser.add_argument("input", nargs="?", type=pathlib.Path, help="変換するファイル")
+    parser.add_argument(
+        "next_flag",
+        nargs="?",
+        default="0",
+        help="最終来院日のフィルタリングに使用するタイムオフセット(-1 ~ 1)",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help=f"{config.STREAM_CHUNK_SIZE}行ずつ読み込んで処理し、メモリ使用量を抑える",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="住所の解決に使うプロセス数(初期値1)。大きなファイルの初回実行で指定してください",
+    )
+    parser.add_argument(
+        "--profile",
+        default=os.environ.get(instrument.PROFILE_ENV, ""),
+        help="プロファイルを取る段階(関数名をカンマ区切り、allで全段階)。"
+        f"環境変数{instrument.PROFILE_ENV}でも指定できます",
+    )
+    parser.add_argument(
+        "--next-flags",
+        type=int,
+        nargs="+",
+        help="複数のnext_flagの郵送分をまとめて出力する(例: --next-flags -1 0 1)",
+    )
+    parser.add_argument(
+        "--cycles",
+        nargs=2,
+        type=datetime.date.fromisoformat,
+        metavar=("FIRST", "LAST"),
+        help="FIRST~LAST(YYYY-MM-DD)の各日に実行した場合の郵送分をまとめて出力する",
+    )
+    parser.add_argument(
+        "--import-profile",
+        action="store_true",
+        help="起動時と住所の解決時に読み込むモジュールごとの時間を表示して終了する",
+    )
+    parser.add_argument(
+        "--ignore-history",
+        action="store_true",
+        help="郵送履歴で同じ回に送付済みの患者も除外せずに出力する(出力のやり直し用)",
+    )
+    parser.add_argument(
+        "--record-history",
+        action="store_true",
+        help="出力した患者を送付済みとして郵送履歴に記録する(next_flagが0の実行だけ)",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="中断した実行の途中経過があれば続きから処理する(--streamで処理します)",
+    )
+    args = parser.parse_args(argv)
+    args.profile = [s for s in args.profile.split(",") if s]
+    if args.cycles and args.cycles[0] > args.cycles[1]:
+        parser.error(
+            f"--cycles: FIRST({args.cycles[0]})はLAST({args.cycles[1]})以前の日付にしてください"
+        )
+
+    # jushoは住所を解決するときに読み込むので、mainの読み込みとは分けて表示する
+    # (mainの読み込み時間は別のプロセスで計るので、ここではmainの残りを読み込まない)
+    if args.import_profile:
+        modules = ["main", "jusho"]
+        instrument.print_import_costs(instrument.import_costs(modules), modules)
+        exit()
+
+    # 受け取るファイルのフルパス
+    if args.input is None:
+        print(
+            "###ERROR### 変換するファイルを指定してください ex) python3 main.py test.txt"
+        )
+        exit()
+
+    # オプション引数の確認
+    try:
+        args.next_flag = int(args.next_flag)
+    except ValueError as e:
+        print(e)
+        print("###ERROR 第二引数next_flagは-1 ~ 1の範囲の整数にしてください")
+        args.next_flag = 0
+    return args
+
+
+if __name__ == "__main__":
+    # ヘルプの表示や引数の誤りの確認は、pandasなどの読み込みに時間がかかるモジュールより先に行う
+    args = parse_args()
+
+import numpy as np
 import pandas as pd
 import postal_number
-import datetimeutil
-import datetime
-import config
-from typing import Optional
+import rejects
+import zip_table
+import address_cache
+import checkpoint
+import export_cache
+import mailing_history
+import ng_list
+import date_series
+import visit_index
 
 # Web郵便サービスに提出するCSVフォーマット
 POSTAL_CODE_TOP3: str = "郵便番号上3桁"  # 郵便番号の上3桁
@@ -27,6 +140,15 @@ NAME: str = "氏名等"  # 氏名
 NAME_HONORIFIC: str = "氏名等敬称"  # 氏名の敬称（例: 様）
 GROUP: str = "グループ名"  # グループ名
 
+# デバッグ用CSVに出力する、郵便番号と住所の都道府県・市区町村が食い違う行の印
+ZIP_MISMATCH: str = "郵便番号と住所の不一致"
+
+# rejects.csvに記録する、住所を解決できなかった理由
+REJECT_NOT_A_STRING: str = "住所が文字列ではありません"
+REJECT_CITY_NOT_FOUND: str = "市区町村がみつかりません"
+REJECT_INVALID_ZIP: str = "住所が空欄で郵便番号が不正です"
+REJECT_UNKNOWN_ZIP: str = "住所が空欄で郵便番号が存在しません"
+
 WEB_POST_REQUIRED_FIELDS: list[str] = [
     POSTAL_CODE_TOP3,
     POSTAL_CODE_LAST4,
@@ -74,9 +196,7 @@ def normalize_postal_code(postal_code: str) -> str:
     postal_code = re.sub(
         r"[^\d０１２３４５６７８９]", "", postal_code
     )  # 数字以外を削除
-    postal_code = postal_code.translate(
-        str.maketrans("０１２３４５６７８９", "0123456789")
-    )  # 全角数字→半角
+    postal_code = postal_code.translate(ng_list.ZENKAKU_DIGITS)  # 全角数字→半角
 
     # 郵便番号が7桁の数字になればフォーマット適用
     if re.match(r"^\d{7}$", postal_code):
@@ -86,16 +206,238 @@ def normalize_postal_code(postal_code: str) -> str:
     return "000-0000"
 
 
-def save_to_csv(df: pd.DataFrame, filename: str | pathlib.Path):
-    """ノーザの出力ファイルはshift_jis、外字のエラーは無視"""
-    df_ = df[WEB_POST_REQUIRED_FIELDS]
-    df_.to_csv(filename, index=False, encoding="shift_jis", errors="replace")
+def split_postal_codes(postal_codes: pd.Series) -> pd.DataFrame:
+    """
+    郵便番号の列をまとめて正規化し、上3桁・下4桁に分割する関数。
 
+    `normalize_postal_code` と同じ規則で列全体を一度に処理します。空欄を含め、
+    7桁の数字にならない値は「000-0000」として扱います。
+    同じ郵便番号は一度だけ変換し、結果の文字列は同じ郵便番号の行で共有します。
 
-def load_csv(input_path: pathlib.Path) -> pd.DataFrame:
-    return pd.read_csv(
-        input_path, encoding="shift_jis", index_col=False, encoding_errors="replace"
+    Args:
+        postal_codes (pd.Series): 郵便番号の列
+
+    Returns:
+        pd.DataFrame: 正規化した郵便番号（`config.POSTAL_CODE_COLUMN`）、
+            `POSTAL_CODE_TOP3`、`POSTAL_CODE_LAST4` の3列（インデックスは入力と同じ）
+    """
+    codes, uniques = pd.factorize(postal_codes.fillna(""))
+    digits = (
+        pd.Series(uniques, dtype=object)
+        .astype(str)
+        .str.translate(ng_list.ZENKAKU_DIGITS)
+        .str.replace(r"\D", "", regex=True)
     )
+    valid = digits.str.len() == 7
+    top3 = digits.str[:3].where(valid, "000")
+    last4 = digits.str[3:].where(valid, "0000")
+    columns = {
+        config.POSTAL_CODE_COLUMN: top3 + "-" + last4,
+        POSTAL_CODE_TOP3: top3,
+        POSTAL_CODE_LAST4: last4,
+    }
+    return pd.DataFrame(
+        {name: values.to_numpy()[codes] for name, values in columns.items()},
+        index=postal_codes.index,
+    )
+
+
+def web_post_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    `convert_to_postal_format` の結果から、webゆうびんの列だけのデータフレームを作る関数。
+
+    氏名・敬称と、このアプリケーションでは使わない空欄の列(建物名や会社名など)は
+    途中のデータフレームには持たせず、出力する行についてだけここで作ります。
+    """
+    df_ = df.reindex(columns=WEB_POST_REQUIRED_FIELDS)
+    df_[NAME] = df[config.NAME_COLUMN]
+    df_[NAME_HONORIFIC] = config.NAME_HONORIFIC
+    return df_
+
+
+@instrument.stage
+def save_to_csv(df: pd.DataFrame, filename: str | pathlib.Path, append: bool = False):
+    """ノーザの出力ファイルはshift_jis、外字のエラーは無視。appendならヘッダなしで追記"""
+    df_ = web_post_frame(df)
+    df_.to_csv(
+        filename,
+        index=False,
+        encoding="shift_jis",
+        errors="replace",
+        mode="a" if append else "w",
+        header=not append,
+    )
+
+
+def input_columns() -> list[str]:
+    """
+    入力ファイルから読み込む列(`config` の列名)。
+
+    ノーザの出力には電話番号や保険区分など26列ありますが、処理に使うのはこれらだけです。
+    入力ファイルにない列は読み込まず、これまでどおり列がない場合の処理を行います。
+    """
+    return [
+        config.NAME_COLUMN,
+        config.PATIENT_ID_COLUMN,
+        config.BIRTHDAY_COLUMN,
+        config.LAST_VISIT_COLUMN,
+        config.POSTAL_CODE_COLUMN,
+        config.ADDRESS_COLUMN,
+    ]
+
+
+def _read_csv_options() -> dict:
+    """`load_csv` と `load_csv_chunks` に共通の `pd.read_csv` の引数"""
+    columns = set(input_columns())
+    return {
+        "encoding": "shift_jis",
+        "index_col": False,
+        "encoding_errors": "replace",
+        "usecols": lambda c: c in columns,
+        # カルテ番号・郵便番号の先頭の0が消えないよう、全て文字列のまま読み込む
+        "dtype": {c: str for c in columns},
+    }
+
+
+class _Utf8Reader(io.RawIOBase):
+    """Shift_JISのファイルを少しずつ読み込み、UTF-8にして返すファイルオブジェクト"""
+
+    def __init__(self, path: pathlib.Path, block_size: int = 1 << 20):
+        self._file = open(path, "rb")
+        self._decoder = codecs.getincrementaldecoder("shift_jis")(errors="replace")
+        self._block_size = block_size
+        self._buffer = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self._buffer:
+            block = self._file.read(self._block_size)
+            self._buffer = self._decoder.decode(block, final=not block).encode("utf-8")
+            if not block:
+                break
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+def read_header(input_path: pathlib.Path) -> list[str]:
+    """入力ファイルの見出し行の列名"""
+    with open(input_path, encoding="shift_jis", errors="replace") as f:
+        return next(csv.reader(f), [])
+
+
+def _load_csv_pyarrow(input_path: pathlib.Path) -> Optional[pd.DataFrame]:
+    """pyarrowのCSVリーダーで読み込む。pyarrowがインストールされていなければNone"""
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pa_csv
+    except ImportError:
+        return None
+
+    columns = set(input_columns())
+    present = [c for c in read_header(input_path) if c in columns]
+    with _Utf8Reader(input_path) as f:
+        table = pa_csv.read_csv(
+            f,
+            convert_options=pa_csv.ConvertOptions(
+                include_columns=present,
+                column_types={c: pa.string() for c in present},
+                strings_can_be_null=True,
+            ),
+        )
+    # 欠損はpandasのCエンジンと同じくNaNにそろえる
+    return table.to_pandas().fillna(float("nan"))
+
+
+@instrument.stage
+def load_csv(input_path: pathlib.Path) -> pd.DataFrame:
+    """
+    入力ファイルのうち `input_columns` の列だけを、文字列のまま読み込む関数。
+
+    `config.CSV_ENGINE` が"pyarrow"でpyarrowがインストールされていれば、pyarrowの
+    CSVリーダーで読み込みます(Shift_JISからUTF-8への変換は少しずつ行います)。
+    """
+    if config.CSV_ENGINE == "pyarrow":
+        df = _load_csv_pyarrow(input_path)
+        if df is not None:
+            return df
+    return pd.read_csv(input_path, **_read_csv_options())
+
+
+def prepare_export(df: pd.DataFrame):
+    """日付の列を日付型に変換し、郵便番号を「000-0000」の形式にそろえる(列がなければ何もしない)"""
+    if config.LAST_VISIT_COLUMN in df.columns:
+        parse_last_visit(df)
+    if config.BIRTHDAY_COLUMN in df.columns:
+        parse_birthday(df)
+    if config.POSTAL_CODE_COLUMN in df.columns:
+        df[config.POSTAL_CODE_COLUMN] = split_postal_codes(
+            df[config.POSTAL_CODE_COLUMN]
+        )[config.POSTAL_CODE_COLUMN]
+
+
+@instrument.stage
+def load_export(input_path: pathlib.Path) -> pd.DataFrame:
+    """
+    入力ファイルを読み込む。`config.EXPORT_CACHE_DIR` を指定している場合は、
+    同じ内容のファイルを前に読み込んだときの変換済みのデータを再利用する。
+
+    キャッシュに保存するデータは `prepare_export` で日付と郵便番号を変換済みにしておくので、
+    再実行時はCSVの読み込みに加えてそれらの変換も省略できます。
+    前に読み込んだときとパス・サイズ・更新日時が同じファイルであれば、内容のハッシュも求めません。
+    """
+    if config.EXPORT_CACHE_DIR is None:
+        return load_csv(input_path)
+    cache = export_cache.ExportCache()
+    key = cache.find(input_path)
+    if key is None:
+        key = export_cache.cache_key(input_path)
+        cache.remember(input_path, key)
+    df = cache.get(key)
+    if df is None:
+        df = load_csv(input_path)
+        prepare_export(df)
+        cache.put(key, df)
+        cache.remember(input_path, key)
+    return df
+
+
+def cached_export(input_path: pathlib.Path) -> Optional[pd.DataFrame]:
+    """
+    `load_export` で保存した変換済みのデータを返す。同じ入力ファイル(パス・サイズ・更新日時)の
+    データがない場合はNone(内容のハッシュは求めないので、ファイル全体は読み込みません)。
+    """
+    if config.EXPORT_CACHE_DIR is None:
+        return None
+    cache = export_cache.ExportCache()
+    key = cache.find(input_path)
+    return cache.get(key) if key is not None else None
+
+
+def store_export(input_path: pathlib.Path, frames: list[pd.DataFrame]):
+    """`prepare_export` で変換済みのチャンクを結合し、`load_export` と同じキャッシュに保存する"""
+    cache = export_cache.ExportCache()
+    key = export_cache.cache_key(input_path)
+    cache.put(key, pd.concat(frames))
+    cache.remember(input_path, key)
+
+
+def frame_chunks(df: pd.DataFrame, chunksize: int) -> Iterator[pd.DataFrame]:
+    """`load_csv_chunks` と同じ区切りで、読み込み済みのデータフレームを `chunksize` 行ずつ返す"""
+    for start in range(0, len(df), chunksize):
+        yield df.iloc[start : start + chunksize]
+
+
+def load_csv_chunks(input_path: pathlib.Path, chunksize: int) -> Iterator[pd.DataFrame]:
+    """`load_csv` と同じ列・型で `chunksize` 行ずつ読み込む(pyarrowは使わない)"""
+    return pd.read_csv(input_path, chunksize=chunksize, **_read_csv_options())
 
 
 def validate_required_columns(df: pd.DataFrame):
@@ -122,131 +464,271 @@ def validate_required_columns(df: pd.DataFrame):
         raise ValueError
 
 
+@instrument.stage
 def process_postal_code(df: pd.DataFrame) -> pd.DataFrame:
-    df[config.POSTAL_CODE_COLUMN] = df[config.POSTAL_CODE_COLUMN].apply(
-        normalize_postal_code
-    )
-    df[[POSTAL_CODE_TOP3, POSTAL_CODE_LAST4]] = df[config.POSTAL_CODE_COLUMN].str.split(
-        "-", expand=True
-    )
-    return df
+    """郵便番号を正規化し、上3桁と下4桁の列を追加したデータフレームを返す(dfは変更しない)"""
+    return df.assign(**split_postal_codes(df[config.POSTAL_CODE_COLUMN]))
 
 
-def exclude_ng(df: pd.DataFrame):
-    if config.PATIENT_ID_COLUMN not in df.columns:
-        print(
-            f"{config.PATIENT_ID_COLUMN}がデータに含まれていないため、NG処理を行わず処理を続行します"
-        )
-        return df
-    nglist = pd.read_csv(
-        config.NG_LIST_PATH,
-        encoding="shift_jis",
-        index_col=False,
-        encoding_errors="replace",
-    )
+_ng_list: Optional[ng_list.NGList] = None
+
 
-    return df[~df[config.PATIENT_ID_COLUMN].isin(nglist[config.PATIENT_ID_COLUMN])]
+def get_ng_list() -> ng_list.NGList:
+    """NGリストを返す。初回だけ読み込み、以降はCSVが変わったときだけ読み込み直す"""
+    global _ng_list
+    if _ng_list is None:
+        _ng_list = ng_list.NGList(config.NG_LIST_PATH)
+    return _ng_list
 
 
-def split_by_birthday(df: pd.DataFrame) -> tuple[pd.DataFrame, Optional[pd.DataFrame]]:
+def ng_mask(df: pd.DataFrame) -> Optional[pd.Series]:
+    """NGリストに含まれる行をTrueとする列を返す。カルテ番号がなければNone"""
+    if config.PATIENT_ID_COLUMN not in df.columns:
+        return None
+    return get_ng_list().contains(df[config.PATIENT_ID_COLUMN])
+
+
+def ped_masks(
+    df: pd.DataFrame, references: list[datetime.date]
+) -> Optional[np.ndarray]:
     """
-    患者データを生年月日を基準に小児患者と成人患者に分割する関数。
+    基準日ごとに、その日の時点で小児の行をTrueとする配列を返す関数。生年月日列がない場合はNone。
 
-    Args:
-        df (pd.DataFrame): 入力データフレーム。生年月日列を含むことを想定。
+    年齢は `date_series.age_bands` でまとめて計算します。生年月日列は日付型に変換します
+    (dfを変更します)。生年月日が不正で年齢が出せない行は成人として扱います。
 
     Returns:
-        tuple[pd.DataFrame, Optional[pd.DataFrame]]:
-            - 成人患者のデータフレーム
-            - 小児患者のデータフレーム（存在しない場合は None）
+        Optional[np.ndarray]: (基準日の数, 行数)の真偽値の配列
     """
     if config.BIRTHDAY_COLUMN not in df.columns:
-        # 生年月日列がない場合の処理
-        print(
-            "###WARNING###: 生年月日が含まれないデータを指定されたので、年齢は考慮せず処理を続行します。"
-        )
-        return df, None
+        return None
 
-    # 生年月日を日付型に変換（必要ならエラー処理を加える）
-    df[config.BIRTHDAY_COLUMN] = df[config.BIRTHDAY_COLUMN].apply(
-        datetimeutil.zenkaku_to_datetime  # 生年月日を datetime.date に変換
+    # 生年月日を日付型に変換（不正な値はNaT）
+    parse_birthday(df)
+    bands = date_series.age_bands(
+        df[config.BIRTHDAY_COLUMN], [config.PED_THRESHOLD], references
     )
+    return bands == 0
 
-    # 現在の日付
-    current_date = datetime.datetime.now().date()
 
-    # 年齢を計算する関数
-    def calculate_age(birth_date: datetime.date) -> int:
-        # 現在の日付から生年月日を引き、満年齢を計算
-        age = current_date.year - birth_date.year
-        # 生年月日の「月日」が現在の「月日」より後の場合、1歳引く
-        if (current_date.month, current_date.day) < (birth_date.month, birth_date.day):
-            age -= 1
-        return age
+def parse_birthday(df: pd.DataFrame):
+    """生年月日の列を日付型に変換する(変換済みなら何もしない)"""
+    if not pd.api.types.is_datetime64_any_dtype(df[config.BIRTHDAY_COLUMN]):
+        df[config.BIRTHDAY_COLUMN] = date_series.zenkaku_to_datetime_series(
+            df[config.BIRTHDAY_COLUMN]
+        )
 
-    # 年齢列を作成
-    df["AGE"] = df[config.BIRTHDAY_COLUMN].apply(calculate_age)
 
-    # 小児患者と成人患者を分割
-    df_ped = df[df["AGE"] < config.PED_THRESHOLD]
-    df_adult = df[df["AGE"] >= config.PED_THRESHOLD]
+def parse_last_visit(df: pd.DataFrame):
+    """最終来院日の列を日付型に変換する(変換済みなら何もしない)"""
+    if not pd.api.types.is_datetime64_any_dtype(df[config.LAST_VISIT_COLUMN]):
+        df[config.LAST_VISIT_COLUMN] = date_series.zenkaku_to_datetime_series(
+            df[config.LAST_VISIT_COLUMN]
+        )
 
-    # 小児患者が存在しない場合は None を返す
-    return df_adult, df_ped if not df_ped.empty else None
 
+def last_visit_index(df: pd.DataFrame) -> visit_index.LastVisitIndex:
+    """最終来院日の列を日付型に変換し、期間の絞り込みに使う索引を作る"""
+    parse_last_visit(df)
+    return visit_index.LastVisitIndex(df[config.LAST_VISIT_COLUMN])
 
-def filter_by_last_visit(
-    df: pd.DataFrame, months: int, next_flag: int
-) -> tuple[pd.DataFrame, datetime.datetime, datetime.datetime]:
-    now = datetime.datetime.now()
+
+def open_last_visit_index(
+    input_path: pathlib.Path, df: pd.DataFrame
+) -> Optional[visit_index.LastVisitIndex]:
+    """
+    入力ファイルの最終来院日の索引を返す。最終来院日の列がない場合はNone。
+
+    前回の実行と同じ入力ファイル(パス・サイズ・更新日時が同じ)であれば保存した索引を
+    読み込み、最終来院日の列全体の変換を省略します。それ以外の場合は作り直して保存します。
+    """
     if config.LAST_VISIT_COLUMN not in df.columns:
-        print(
-            "最終来院日が含まれないデータを指定されたので、来院日は考慮せず処理を続行します。"
-        )
-        return df, now, now
-    df[config.LAST_VISIT_COLUMN] = df[config.LAST_VISIT_COLUMN].apply(
-        datetimeutil.zenkaku_to_datetime
-    )
-    start, end = datetimeutil.get_start_and_end_day_2(now, -months, next_flag)
-    return (
-        df[
-            (df[config.LAST_VISIT_COLUMN] >= start)
-            & (df[config.LAST_VISIT_COLUMN] <= end)
-        ],
-        start,
-        end,
-    )
+        return None
+    if config.LAST_VISIT_INDEX_PATH is None:
+        return last_visit_index(df)
+    key = visit_index.input_key(input_path)
+    index = visit_index.LastVisitIndex.load(config.LAST_VISIT_INDEX_PATH, key)
+    if index is None or index.length != len(df):
+        index = last_visit_index(df)
+        index.save(config.LAST_VISIT_INDEX_PATH, key)
+    return index
+
+
+@instrument.stage
+def select_candidates(
+    df: pd.DataFrame,
+    windows: list["RecallWindow"],
+    row_counts: dict[str, int],
+    index: Optional[visit_index.LastVisitIndex] = None,
+    history: Optional[mailing_history.MailingHistory] = None,
+) -> pd.DataFrame:
+    """
+    NGリスト・郵送履歴と最終来院日だけを見て、以降の処理の対象になりうる行に絞り込む関数。
+
+    どの判定もカルテ番号・最終来院日の1列だけで行えるため、生年月日の変換や住所の解決より
+    先に行い、残った行だけを後の処理に渡します。小児か成人かはまだ分からないので、
+    最終来院日はいずれかの郵送の成人・小児どちらかの期間に入っていれば残し、郵送履歴は
+    いずれかの郵送の回で送付済みであれば除外します。
+
+    Args:
+        df (pd.DataFrame): 読み込んだデータフレーム
+        windows (list[RecallWindow]): 対象にする郵送ごとの期間
+        row_counts (dict[str, int]): 段階ごとの残り行数を加算する辞書
+        index (LastVisitIndex, optional): dfの最終来院日の索引。省略時はここで作成
+        history (MailingHistory, optional): 郵送履歴。省略時は送付済みの患者も残す
+
+    Returns:
+        pd.DataFrame: 対象になりうる行だけのデータフレーム
+    """
+    keep = pd.Series(True, index=df.index)
+    is_ng = ng_mask(df)
+    if is_ng is not None:
+        keep &= ~is_ng
+    count_rows(row_counts, "NGリスト除外", int(keep.sum()))
+
+    if history is not None and config.PATIENT_ID_COLUMN in df.columns:
+        cycles = mailing_cycles(windows, config.BIRTHDAY_COLUMN in df.columns)
+        keep &= ~history.contains(df[config.PATIENT_ID_COLUMN], cycles)
+        count_rows(row_counts, "送付済み除外", int(keep.sum()))
+
+    if config.LAST_VISIT_COLUMN not in df.columns:
+        count_rows(row_counts, "最終来院日(成人・小児の期間)", int(keep.sum()))
+        return df[keep]
+
+    periods = [w.adult for w in windows]
+    if config.BIRTHDAY_COLUMN in df.columns:
+        periods += [w.ped for w in windows]
+    index = index or last_visit_index(df)
+    keep &= index.mask(periods)
+    count_rows(row_counts, "最終来院日(成人・小児の期間)", int(keep.sum()))
+
+    # 保存した索引を使った場合、日付型への変換は残った行だけに行う
+    df = df[keep].copy()
+    parse_last_visit(df)
+    return df
+
 
+@instrument.stage
+def normalize_addresses(addresses: pd.Series) -> pd.Series:
+    """
+    住所の列を `postal_number.normalize_address` で正規化したキーの列にする関数。
 
-def resolve_address(df):
-    """住所を都道府県・市区町村名・町域名に変換、住所がない場合郵便番号から検索して埋める"""
-    # if pd.isna(df[config.ADDRESS_COLUMN]):
-    #     return postal_number.get_address(df[POSTAL_CODE_TOP3] + df[POSTAL_CODE_LAST4])
-    return postal_number.get_postal_number(df[config.ADDRESS_COLUMN])
+    同じ住所が多いので、異なる住所ごとに一度だけ正規化します。文字列でない値はそのまま返します。
+    """
+    codes, uniques = pd.factorize(addresses, use_na_sentinel=False)
+    keys = [
+        postal_number.normalize_address(a) if type(a) is str else a for a in uniques
+    ]
+    return pd.Series(
+        pd.Series(keys, dtype=object).take(codes).to_numpy(), index=addresses.index
+    )
 
 
-def convert_to_postal_format(df: pd.DataFrame) -> pd.DataFrame:
-    # 読み込んだCSVにweb郵便に必要なカラムを追加
-    df = df.assign(**{field: float("NaN") for field in WEB_POST_REQUIRED_FIELDS})
+@instrument.stage
+def resolve_addresses(
+    df: pd.DataFrame,
+    cache: Optional[address_cache.AddressCache] = None,
+    workers: int = 1,
+    reject_log: Optional[rejects.RejectLog] = None,
+) -> pd.DataFrame:
+    """
+    住所を都道府県・市区町村名・町域名に変換、住所がない場合郵便番号から検索して埋める関数。
 
-    # 名前を入力
-    df[NAME] = df[config.NAME_COLUMN]
+    郵便番号は `zip_table` の表とまとめて結合し、住所から求めた都道府県・市区町村と
+    郵便番号のものが食い違う行には `ZIP_MISMATCH` 列をTrueにします。
+    解決できなかった行も「#####」を入れて処理を続け、reject_logを指定した場合は
+    その行と理由を記録します。
 
-    # 敬称の入力
-    df[NAME_HONORIFIC] = config.NAME_HONORIFIC
+    Returns:
+        pd.DataFrame: 都道府県名・市区町村名(カテゴリ型)・町域名と `ZIP_MISMATCH` の列
+    """
+    zip_codes = df[POSTAL_CODE_TOP3] + df[POSTAL_CODE_LAST4]
+    found = zip_table.lookup(zip_codes)
+    addresses = df[config.ADDRESS_COLUMN]
+    has_address = addresses.notna() & (addresses.astype(str).str.strip() != "")
+
+    keys = normalize_addresses(addresses[has_address])
+    resolved = pd.DataFrame(
+        postal_number.resolve_many(keys, cache, workers),
+        index=addresses.index[has_address],
+        columns=[PREFECTURE, CITY, AREA],
+    )
+    filled = zip_table.fill_values(zip_codes[~has_address], found[~has_address])
+    filled.columns = [PREFECTURE, CITY, AREA]
+    resolved = pd.concat([resolved, filled]).reindex(df.index)
+
+    resolved[ZIP_MISMATCH] = (
+        has_address
+        & found["prefecture"].notna()
+        & (
+            (resolved[PREFECTURE] != found["prefecture"])
+            | (resolved[CITY] != found["city"])
+        )
+    )
+    if reject_log is not None:
+        log_rejects(df, has_address, zip_codes, found, resolved, reject_log)
+
+    # 都道府県・市区町村は種類が少ないのでカテゴリ型にしてメモリを減らす
+    resolved[PREFECTURE] = resolved[PREFECTURE].astype("category")
+    resolved[CITY] = resolved[CITY].astype("category")
+    return resolved
+
+
+def log_rejects(
+    df: pd.DataFrame,
+    has_address: pd.Series,
+    zip_codes: pd.Series,
+    found: pd.DataFrame,
+    resolved: pd.DataFrame,
+    reject_log: rejects.RejectLog,
+):
+    """`resolve_addresses` で解決できなかった行を理由ごとに記録する"""
+    addresses = df[config.ADDRESS_COLUMN]
+    not_str = has_address & ~addresses.map(lambda a: type(a) is str)
+    city_not_found = has_address & ~not_str & (resolved[CITY] == "#####")
+    invalid_zip = ~has_address & (zip_codes == "0000000")
+    unknown_zip = ~has_address & ~invalid_zip & found["prefecture"].isna()
+
+    reject_log.add(df[not_str], REJECT_NOT_A_STRING, addresses[not_str].map(repr))
+    reject_log.add(df[city_not_found], REJECT_CITY_NOT_FOUND)
+    for mask, reason in (
+        (invalid_zip, REJECT_INVALID_ZIP),
+        (unknown_zip, REJECT_UNKNOWN_ZIP),
+    ):
+        reject_log.add(df[mask], reason, df.loc[mask, config.POSTAL_CODE_COLUMN])
+
+
+@instrument.stage
+def convert_to_postal_format(
+    df: pd.DataFrame,
+    cache: Optional[address_cache.AddressCache] = None,
+    workers: int = 1,
+    reject_log: Optional[rejects.RejectLog] = None,
+) -> pd.DataFrame:
+    """
+    webゆうびんに必要なカラムを追加し、郵便番号と住所を変換する関数。
 
-    # 郵便番号を正規化し、上3桁と下4桁に分割
+    Args:
+        df (pd.DataFrame): 対象のデータフレーム
+        cache (AddressCache | None): 住所解決キャッシュ
+        workers (int): 住所の解決に使うプロセス数。大きなファイルの初回実行向けで、
+            小さなファイルでは1(単一プロセス)のままにしてください
+        reject_log (RejectLog | None): 住所を解決できなかった行を記録する
 
+    Returns:
+        pd.DataFrame: webゆうびんのカラムを追加したデータフレーム
+    """
+    # 郵便番号を正規化し、上3桁と下4桁に分割(氏名・敬称などの列は出力時に `web_post_frame` で作る)
     df = process_postal_code(df)
 
     # 住所の解決
-    df[[PREFECTURE, CITY, AREA]] = df.apply(
-        resolve_address, axis=1, result_type="expand"
+    df[[PREFECTURE, CITY, AREA, ZIP_MISMATCH]] = resolve_addresses(
+        df, cache, workers, reject_log
     )
     return df
 
 
-def create_output_dir(input_path: pathlib.Path) -> pathlib.Path:
+def create_output_dir(input_path: pathlib.Path, unique: bool = False) -> pathlib.Path:
     """
     入力パスに基づいて出力ディレクトリを作成し、そのパスを返します。
 
@@ -255,6 +737,7 @@ def create_output_dir(input_path: pathlib.Path) -> pathlib.Path:
 
     Args:
         input_path (pathlib.Path): 入力ファイルのパス。
+        unique (bool): Trueの場合、日付の後ろに時刻(`HHMMSS`)も付け、同じ日の出力と分ける。
 
     Returns:
         pathlib.Path: 作成された出力ディレクトリのパス。
@@ -267,7 +750,10 @@ def create_output_dir(input_path: pathlib.Path) -> pathlib.Path:
 
     # 現在の日付をフォーマット
     now = datetime.datetime.now()
-    dirname = now.strftime("%Y%m%d") + "_" + input_path.stem  # ファイル名に日付を追加
+    date_format = "%Y%m%d_%H%M%S" if unique else "%Y%m%d"
+    dirname = (
+        now.strftime(date_format) + "_" + input_path.stem
+    )  # ファイル名に日付を追加
 
     # 出力パスを作成
     output_path = output_parent_dir / dirname
@@ -278,9 +764,7 @@ def create_output_dir(input_path: pathlib.Path) -> pathlib.Path:
     return output_path
 
 
-def save_debug_csv(df, df_ped, output_dir: pathlib.Path):
-    if df_ped is not None:
-        df = pd.concat([df, df_ped])
+def select_debug_columns(df: pd.DataFrame) -> pd.DataFrame:
     debug_candidate = [
         config.NAME_COLUMN,
         config.PATIENT_ID_COLUMN,
@@ -288,84 +772,772 @@ def save_debug_csv(df, df_ped, output_dir: pathlib.Path):
         config.LAST_VISIT_COLUMN,
         config.POSTAL_CODE_COLUMN,
         config.ADDRESS_COLUMN,
+        ZIP_MISMATCH,
     ]
     debug_columns = [c for c in debug_candidate if c in df.columns]
+    return df[debug_columns]
+
+
+@instrument.stage
+def save_debug_csv(frames: list[Optional[pd.DataFrame]], output_dir: pathlib.Path):
+    """framesを順に `debug.csv` に書き出す(結合したデータフレームは作らない)"""
+    frames = [f for f in frames if f is not None]
+    for i, df in enumerate(frames):
+        select_debug_columns(df).to_csv(
+            output_dir / "debug.csv",
+            index=False,
+            header=i == 0,
+            mode="w" if i == 0 else "a",
+            encoding="shift_jis",
+            errors="replace",
+        )
+
+
+def open_address_cache() -> Optional[address_cache.AddressCache]:
+    """設定されていれば住所解決キャッシュを開く"""
+    if not config.ADDRESS_CACHE_PATH:
+        return None
+    return address_cache.AddressCache(config.ADDRESS_CACHE_PATH)
+
 
-    df = df[debug_columns]
-    df.to_csv(
-        output_dir / "debug.csv", index=False, encoding="shift_jis", errors="replace"
+def open_mailing_history() -> Optional[mailing_history.MailingHistory]:
+    """設定されていれば郵送履歴を開く"""
+    if not config.MAILING_HISTORY_PATH:
+        return None
+    return mailing_history.MailingHistory(config.MAILING_HISTORY_PATH)
+
+
+def has_output_rows(output_dir: pathlib.Path) -> bool:
+    """出力フォルダに、見出し行以外も書き出した郵送用のCSVがあるか"""
+    for path in output_dir.glob("*.csv"):
+        if path.name in ("debug.csv", "rejects.csv"):
+            continue
+        with open(path, "rb") as f:
+            f.readline()
+            if f.readline():
+                return True
+    return False
+
+
+def prepare_output_dir(
+    input_path: pathlib.Path,
+    windows: list["RecallWindow"],
+    history: Optional[mailing_history.MailingHistory],
+) -> pathlib.Path:
+    """
+    出力フォルダを作成して返す関数。
+
+    郵送履歴で送付済みの患者を除外する実行(historyを指定)で、今回の郵送の回に送付済みの
+    患者がいる場合は、同じ日の出力フォルダに前回の出力があれば上書きせず、時刻を付けた
+    別のフォルダに出力します。送付済みの患者を除いた出力で、前回の出力が消えないようにするためです。
+    """
+    output_dir = create_output_dir(input_path)
+    if history is None or not has_output_rows(output_dir):
+        return output_dir
+    if len(history.sent_ids(mailing_cycles(windows))) == 0:
+        return output_dir
+    new_dir = create_output_dir(input_path, unique=True)
+    print(
+        f"{output_dir}の出力を残すため、送付済みの患者を除いた出力は{new_dir}に保存します"
     )
+    return new_dir
 
 
-if __name__ == "__main__":
-    input_csv_path: pathlib.Path
-    # 受け取るファイルのフルパス
-    try:
-        input_csv_path = pathlib.Path(sys.argv[1])
-    except IndexError as e:
+def check_record_history(
+    record_history: bool, next_flag: int, windows: Optional[list["RecallWindow"]]
+) -> bool:
+    """郵送履歴に記録するかを返す。先の郵送分などの確認用の実行では記録しない"""
+    if record_history and is_preview(next_flag, windows):
         print(
-            "###ERROR### 変換するファイルを指定してください ex) python3 main.py test.txt"
+            "next_flagが0以外、または複数の郵送分をまとめた出力は確認用のため、郵送履歴に記録しません"
         )
-        print(e)
-        exit()
+        return False
+    return record_history
 
-    # オプション引数の確認
-    try:
-        next_flag = int(sys.argv[2])
-    except IndexError:
-        next_flag = 0
-    except ValueError as e:
-        print(e)
-        print("###ERROR 第二引数next_flagは-1 ~ 1の範囲の整数にしてください")
-        next_flag = 0
 
-    # CSVデータを読み込み
-    df = load_csv(input_csv_path)
+def is_preview(next_flag: int, windows: Optional[list["RecallWindow"]]) -> bool:
+    """今回の郵送(next_flagが0で、期間を1回分だけ指定した実行)以外の出力か"""
+    return next_flag != 0 or windows is not None
 
-    # 郵便番号と患者氏名の必須カラム確認
-    validate_required_columns(df)
 
-    # ngリストに当てはまるものを除外
-    df = exclude_ng(df)
+def mailing_cycles(windows: list["RecallWindow"], ped: bool = True) -> list[str]:
+    """郵送ごとの成人(pedがTrueなら小児も)の郵送の回を返す"""
+    cycles = [mailing_history.cycle_name("adult", w.adult[0]) for w in windows]
+    if ped:
+        cycles += [mailing_history.cycle_name("ped", w.ped[0]) for w in windows]
+    return cycles
+
+
+def record_mailing(
+    history: Optional[mailing_history.MailingHistory],
+    windows: list["RecallWindow"],
+    adult: list[list[pd.DataFrame]],
+    ped: list[list[pd.DataFrame]],
+):
+    """
+    出力した患者を郵送履歴に記録する関数。
+
+    adult・pedはwindowsと同じ順の、郵送ごとに出力したデータフレームのリストです。
+    カルテ番号の列がない場合は記録しません。
+    """
+    if history is None:
+        return
+    for window, adult_frames, ped_frames in zip(windows, adult, ped):
+        for kind, start, frames in (
+            ("adult", window.adult[0], adult_frames),
+            ("ped", window.ped[0], ped_frames),
+        ):
+            ids = [
+                df[config.PATIENT_ID_COLUMN]
+                for df in frames
+                if config.PATIENT_ID_COLUMN in df.columns
+            ]
+            if ids:
+                history.record(pd.concat(ids), mailing_history.cycle_name(kind, start))
+
+
+def adult_output_path(
+    output_dir: pathlib.Path, start: datetime.datetime, end: datetime.datetime
+) -> pathlib.Path:
+    return output_dir / f"{start.strftime('%Y_%m_%d')}-{end.strftime('%Y_%m_%d')}.csv"
+
+
+def ped_output_path(
+    output_dir: pathlib.Path, start: datetime.datetime, end: datetime.datetime
+) -> pathlib.Path:
+    return (
+        output_dir / f"{start.strftime('%Y_%m_%d')}-{end.strftime('%Y_%m_%d')}_ped.csv"
+    )
 
-    # 生年月日が含まれるデータの場合、小児と成人を分けて処理
-    df, df_ped = split_by_birthday(df)
 
-    # 最終来院日が存在する場合、対象をしぼる
-    df, adult_start, adult_end = filter_by_last_visit(
-        df, config.RECALL_INTERVAL_MONTHS, next_flag
+def print_summary(
+    adult_start: datetime.datetime,
+    adult_end: datetime.datetime,
+    adult_count: int,
+    ped_start: Optional[datetime.datetime],
+    ped_end: Optional[datetime.datetime],
+    ped_count: Optional[int],
+):
+    print(
+        f"{adult_start.strftime('%Y/%m/%d')}~{adult_end.strftime('%d')}の成人患者数: {adult_count}"
     )
-    if df_ped is not None:
-        df_ped, ped_start, ped_end = filter_by_last_visit(
-            df_ped, config.PED_RECALL_INTERVAL_MONTHS, next_flag
+    if ped_count is not None:
+        print(
+            f"{ped_start.strftime('%Y/%m/%d')}~{ped_end.strftime('%d')}の小児患者数: {ped_count}"
         )
 
-    # web郵便のフォーマットにする
-    df = convert_to_postal_format(df)
-    if df_ped is not None:
-        df_ped = convert_to_postal_format(df_ped)
-    # ディレクトリ作成とCSV出力
-    output_dir = create_output_dir(input_csv_path)
-    save_to_csv(
+
+class RecallWindow:
+    """
+    1回の郵送で対象にする、成人・小児それぞれの最終来院日の期間。
+
+    Args:
+        now (datetime.datetime): 実行日(郵送の基準日)
+        next_flag (int): 最終来院日のフィルタリングに使用するタイムオフセット
+    """
+
+    def __init__(self, now: datetime.datetime, next_flag: int = 0):
+        self.now = now
+        self.next_flag = next_flag
+        periods = visit_index.recall_periods(now, next_flag)
+        self.adult = periods["adult"]
+        self.ped = periods["ped"]
+
+
+def windows_for_next_flags(
+    next_flags: Iterable[int], now: Optional[datetime.datetime] = None
+) -> list[RecallWindow]:
+    """今日を基準に、next_flagごとの郵送の期間を返す"""
+    now = now or datetime.datetime.now()
+    return [RecallWindow(now, next_flag) for next_flag in next_flags]
+
+
+def windows_for_cycles(first: datetime.date, last: datetime.date) -> list[RecallWindow]:
+    """
+    first~lastの各日に実行した場合の郵送の期間を、重複を除いて日付順に返す関数。
+
+    郵送は月3回なので、例えば1か月分を指定すると3回分の期間になります。
+    """
+    windows: dict[tuple, RecallWindow] = {}
+    day = first
+    while day <= last:
+        window = RecallWindow(datetime.datetime(day.year, day.month, day.day))
+        windows.setdefault((window.adult, window.ped), window)
+        day += datetime.timedelta(days=1)
+    return list(windows.values())
+
+
+def warn_missing_columns(columns: Iterable[str]):
+    """
+    入力ファイルにない列によって省略する処理を表示する関数。
+
+    `--stream` ではチャンクごとに同じ表示を繰り返さないよう、チャンクを処理する前に1回だけ呼びます。
+    """
+    columns = set(columns)
+    if config.PATIENT_ID_COLUMN not in columns:
+        print(
+            f"{config.PATIENT_ID_COLUMN}がデータに含まれていないため、NG処理を行わず処理を続行します"
+        )
+    if config.BIRTHDAY_COLUMN not in columns:
+        print(
+            "###WARNING###: 生年月日が含まれないデータを指定されたので、年齢は考慮せず処理を続行します。"
+        )
+    if config.LAST_VISIT_COLUMN not in columns:
+        print(
+            "最終来院日が含まれないデータを指定されたので、来院日は考慮せず処理を続行します。"
+        )
+
+
+def windows_for_columns(
+    windows: list[RecallWindow], columns: Iterable[str]
+) -> list[RecallWindow]:
+    """
+    入力ファイルの列に合わせて郵送の期間を返す関数。
+
+    最終来院日の列がない場合は全ての患者が対象になり、どの郵送も同じ出力になるので、
+    複数の郵送を指定していても最初の1回分だけにします。
+    """
+    if config.LAST_VISIT_COLUMN in columns or len(windows) <= 1:
+        return windows
+    print(
+        "最終来院日が含まれないデータのため、複数の郵送分は出力せず1回分だけ出力します"
+    )
+    return windows[:1]
+
+
+class RecallResult:
+    """`process_frame` の郵送1回分の結果。小児の期間と件数は生年月日列がない場合None"""
+
+    def __init__(
+        self,
+        adult: pd.DataFrame,
+        adult_start: datetime.datetime,
+        adult_end: datetime.datetime,
+        ped: Optional[pd.DataFrame] = None,
+        ped_start: Optional[datetime.datetime] = None,
+        ped_end: Optional[datetime.datetime] = None,
+    ):
+        self.adult = adult
+        self.adult_start = adult_start
+        self.adult_end = adult_end
+        self.ped = ped
+        self.ped_start = ped_start
+        self.ped_end = ped_end
+
+
+def count_rows(row_counts: dict[str, int], stage: str, rows: int):
+    row_counts[stage] = row_counts.get(stage, 0) + rows
+
+
+def print_row_counts(row_counts: dict[str, int]):
+    for stage, rows in row_counts.items():
+        print(f"[行数] {stage}: {rows}")
+
+
+def period_label(start: datetime.datetime, end: datetime.datetime) -> str:
+    return f"{start.strftime('%Y/%m/%d')}~{end.strftime('%d')}"
+
+
+def process_frame(
+    df: pd.DataFrame,
+    windows: list[RecallWindow],
+    cache: Optional[address_cache.AddressCache],
+    row_counts: dict[str, int],
+    workers: int = 1,
+    index: Optional[visit_index.LastVisitIndex] = None,
+    history: Optional[mailing_history.MailingHistory] = None,
+    reject_log: Optional[rejects.RejectLog] = None,
+) -> list[RecallResult]:
+    """
+    読み込んだデータフレームを、郵送ごと・成人と小児ごとのwebゆうびん形式に変換する関数。
+
+    1列だけで判定できる絞り込み(NGリスト・郵送履歴・最終来院日)を先に行い、残った行だけに
+    生年月日の変換と住所の解決を行います。複数の郵送の期間を指定した場合も、読み込みや
+    生年月日の変換、住所の解決は全期間の対象者をまとめて1回だけ行い、期間ごとに振り分けます。
+    期間ごとの振り分けは最終来院日の索引(`visit_index.LastVisitIndex`)で行います。
+    各段階の残り行数を `row_counts` に加算します。
+
+    Returns:
+        list[RecallResult]: windowsと同じ順の郵送ごとの結果
+    """
+    count_rows(row_counts, "読み込み", len(df))
+
+    # NGリスト・郵送履歴と最終来院日で、対象になりうる行だけに絞る
+    df = select_candidates(df, windows, row_counts, index, history)
+
+    # 生年月日が含まれるデータの場合、小児と成人を分けて処理
+    # 小児の出力は生年月日列があれば、対象者がいなくても常に行う
+    # 年齢は郵送ごとに、その郵送の実行日の時点で数える
+    is_ped = ped_masks(df, [w.now.date() for w in windows])
+    has_ped = is_ped is not None
+    if not has_ped:
+        is_ped = np.zeros((len(windows), len(df)), dtype=bool)
+
+    adult_periods = [w.adult for w in windows]
+    ped_periods = [w.ped for w in windows]
+    has_last_visit = config.LAST_VISIT_COLUMN in df.columns
+    if not has_last_visit:
+        now = datetime.datetime.now()
+        adult_periods = ped_periods = [(now, now)] * len(windows)
+
+    # 成人・小児それぞれの期間に入る行だけを残し、住所をまとめて1回で解決する
+    # 以降は1つのデータフレームから、成人・小児と期間の行をマスクで取り出す
+    if has_last_visit:
+        index = last_visit_index(df)
+        keep = np.zeros(len(df), dtype=bool)
+        for ped, adult_period, ped_period in zip(is_ped, adult_periods, ped_periods):
+            keep |= np.where(ped, index.mask([ped_period]), index.mask([adult_period]))
+        df = df[keep]
+        is_ped = is_ped[:, keep]
+    df = convert_to_postal_format(df, cache, workers, reject_log)
+
+    # 振り分けでは同じデータに郵送の数だけ期間を問い合わせるので、索引は1回だけ作る
+    index = last_visit_index(df) if has_last_visit else None
+
+    def select(rows: np.ndarray, period) -> pd.DataFrame:
+        if index is not None:
+            rows = rows & index.mask([period])
+        return df[rows]
+
+    results = []
+    for ped, adult_period, ped_period in zip(is_ped, adult_periods, ped_periods):
+        result = RecallResult(select(~ped, adult_period), *adult_period)
+        count_rows(row_counts, f"成人{period_label(*adult_period)}", len(result.adult))
+        if has_ped:
+            result.ped = select(ped, ped_period)
+            result.ped_start, result.ped_end = ped_period
+            count_rows(row_counts, f"小児{period_label(*ped_period)}", len(result.ped))
+        results.append(result)
+    return results
+
+
+class RunCancelled(Exception):
+    """`run_stream` の処理が `cancel` によって中止されたことを表す例外"""
+
+
+def save_run_report(
+    report: instrument.RunReport,
+    output_dir: pathlib.Path,
+    cache: Optional[address_cache.AddressCache],
+    row_counts: dict[str, int],
+    **extra,
+):
+    """段階ごとの計測結果と住所解決キャッシュのヒット率を `run_report.json` に書き出す"""
+    cache_stats = None
+    if cache is not None:
+        lookups = cache.hits + cache.misses
+        cache_stats = {
+            "hits": cache.hits,
+            "misses": cache.misses,
+            "hit_ratio": cache.hits / lookups if lookups else None,
+        }
+    report.save(output_dir, **extra, row_counts=row_counts, address_cache=cache_stats)
+    instrument.stop()
+
+
+def run(
+    input_csv_path: pathlib.Path,
+    next_flag: int = 0,
+    workers: int = 1,
+    profile: Iterable[str] = (),
+    windows: Optional[list[RecallWindow]] = None,
+    ignore_history: bool = False,
+    record_history: bool = False,
+) -> pathlib.Path:
+    """
+    入力ファイル全体を読み込んで変換し、結果を出力して出力フォルダを返す。
+
+    windowsを指定した場合はnext_flagの代わりにその郵送の期間ごとに出力します。
+    郵送履歴で同じ郵送の回に送付済みの患者は除外します。ignore_historyがTrueの場合は
+    除外せずに全員を出力します。record_historyがTrueの場合は、出力が終わった後に
+    今回の出力分を送付済みとして郵送履歴に記録します(`is_preview` の実行では記録しません)。
+    """
+    report = instrument.start(profile)
+    row_counts: dict[str, int] = {}
+    record_history = check_record_history(record_history, next_flag, windows)
+    windows = windows or windows_for_next_flags([next_flag])
+
+    # CSVデータを読み込み(同じファイルを前に読み込んでいれば変換済みのデータを再利用)
+    df = load_export(input_csv_path)
+
+    # 郵便番号と患者氏名の必須カラム確認
+    validate_required_columns(df)
+    warn_missing_columns(df.columns)
+    windows = windows_for_columns(windows, df.columns)
+
+    # web郵便のフォーマットにする(住所の解決結果は前回までの実行分をキャッシュから再利用)
+    cache = open_address_cache()
+    history = open_mailing_history()
+    reject_log = rejects.RejectLog()
+    index = open_last_visit_index(input_csv_path, df)
+    results = process_frame(
         df,
-        output_dir
-        / f"{adult_start.strftime('%Y_%m_%d')}-{adult_end.strftime('%Y_%m_%d')}.csv",
+        windows,
+        cache,
+        row_counts,
+        workers,
+        index,
+        None if ignore_history else history,
+        reject_log,
     )
-    if df_ped is not None:
+    if cache is not None:
+        cache.close()
+
+    # ディレクトリ作成とCSV出力
+    output_dir = prepare_output_dir(
+        input_csv_path, windows, None if ignore_history else history
+    )
+    debug_frames = []
+    for result in results:
         save_to_csv(
-            df_ped,
-            output_dir
-            / f"{ped_start.strftime('%Y_%m_%d')}-{ped_end.strftime('%Y_%m_%d')}_ped.csv",
+            result.adult,
+            adult_output_path(output_dir, result.adult_start, result.adult_end),
         )
-
-    # デバッグ用CSV出力
-    save_debug_csv(df_ped, df, output_dir)
+        if result.ped is not None:
+            save_to_csv(
+                result.ped,
+                ped_output_path(output_dir, result.ped_start, result.ped_end),
+            )
+        debug_frames += [result.ped, result.adult]
+
+    # デバッグ用CSVと、住所を解決できなかった行の出力
+    save_debug_csv(debug_frames, output_dir)
+    reject_log.save(output_dir)
+
+    # 出力が終わってから郵送履歴に記録する
+    record_mailing(
+        history if record_history else None,
+        windows,
+        [[result.adult] for result in results],
+        [[result.ped] if result.ped is not None else [] for result in results],
+    )
+    if history is not None:
+        history.close()
+    save_run_report(
+        report,
+        output_dir,
+        cache,
+        row_counts,
+        input=input_csv_path,
+        next_flags=[w.next_flag for w in windows],
+        windows=[period_label(*w.adult) for w in windows],
+        mode="memory",
+    )
 
     # 処理結果の表示
-    print(
-        f"{adult_start.strftime('%Y/%m/%d')}~{adult_end.strftime('%d')}の成人患者数: {len(df)}"
+    print_row_counts(row_counts)
+    reject_log.print_summary()
+    for result in results:
+        print_summary(
+            result.adult_start,
+            result.adult_end,
+            len(result.adult),
+            result.ped_start,
+            result.ped_end,
+            len(result.ped) if result.ped is not None else None,
+        )
+    return output_dir
+
+
+def run_stream(
+    input_csv_path: pathlib.Path,
+    next_flag: int = 0,
+    chunksize: int = config.STREAM_CHUNK_SIZE,
+    workers: int = 1,
+    profile: Iterable[str] = (),
+    windows: Optional[list[RecallWindow]] = None,
+    progress: Optional[Callable[[int], None]] = None,
+    cancel: Optional[threading.Event] = None,
+    ignore_history: bool = False,
+    resume: bool = False,
+    record_history: bool = False,
+) -> pathlib.Path:
+    """
+    入力ファイルを `chunksize` 行ずつ読み込んで変換し、結果を出力ファイルに追記する。
+
+    各チャンクは `run` と同じ処理を通るため、出力は `run` と同じ内容になります。
+    メモリに保持するのは1チャンク分だけなので、ファイルの大きさによらず使用メモリはほぼ一定です。
+    デバッグ用CSVは `run` と同じく郵送ごとに小児、成人の順に並べるため、チャンクごとに
+    一時ファイルへ書き出しておき、最後に結合します。
+    record_historyがTrueの場合の郵送履歴への記録は、全てのチャンクを出力し終えてから
+    まとめて行います。
+    チャンクを出力し終えるたびに途中経過(`checkpoint.Checkpoint`)を出力フォルダに保存し、
+    全て終わったら削除します。
+
+    Args:
+        progress (Callable[[int], None], optional): チャンクを処理するたびに、処理済みの行数を渡して呼ぶ関数
+        cancel (threading.Event, optional): セットされると次のチャンクの前で処理を中止し、
+            この実行で書き出したファイルを削除して `RunCancelled` を送出する
+        ignore_history (bool): Trueの場合、郵送履歴で送付済みの患者も除外せずに出力する
+        record_history (bool): Trueの場合、出力した患者を送付済みとして郵送履歴に記録する
+            (`is_preview` の実行では記録しない)
+        resume (bool): Trueの場合、同じ入力ファイル・期間で中断した実行の途中経過があれば、
+            最後に出力し終えたチャンクの続きから処理する
+
+    Returns:
+        pathlib.Path: 出力フォルダ
+    """
+    report = instrument.start(profile)
+    record_history = check_record_history(record_history, next_flag, windows)
+    header = read_header(input_csv_path)
+    warn_missing_columns(header)
+    windows = windows_for_columns(
+        windows or windows_for_next_flags([next_flag]), header
     )
-    if df_ped is not None:
-        print(
-            f"{ped_start.strftime('%Y/%m/%d')}~{ped_end.strftime('%d')}の小児患者数: {len(df_ped)}"
+    key = checkpoint.run_key(
+        input_csv_path,
+        [(w.adult, w.ped) for w in windows],
+        chunksize,
+        ignore_history,
+    )
+    history = open_mailing_history()
+    found = None
+    if resume:
+        found = checkpoint.find(pathlib.Path(config.OUTPUT_DIR), input_csv_path, key)
+        if found is None:
+            print("再開できる途中経過がないため、最初から処理します")
+    if found is not None:
+        output_dir, saved, state = found
+        print(f"{output_dir}の途中経過から再開します({state['rows_done']}行処理済み)")
+        # 年齢は中断前と同じ日の時点で数える
+        windows = [RecallWindow(now, next_flag) for now, next_flag in state["windows"]]
+    else:
+        output_dir = prepare_output_dir(
+            input_csv_path, windows, None if ignore_history else history
+        )
+        saved = checkpoint.Checkpoint(output_dir, key)
+        state = {
+            "windows": [(w.now, w.next_flag) for w in windows],
+            "chunks_done": 0,
+            "rows_done": 0,
+            "row_counts": {},
+            "first": None,
+            "debug_header": None,
+            "adult_counts": [0] * len(windows),
+            "ped_counts": [0] * len(windows),
+            "written": set(),
+        }
+        # 以前の途中経過の記録に追記しないよう消しておく
+        saved.remove()
+    debug_parts = [
+        output_dir / f"debug_{i}_{kind}.csv.part"
+        for i in range(len(windows))
+        for kind in ("ped", "adult")
+    ]
+    if found is None:
+        # 以前に中断した実行の一時ファイルに追記しないよう消しておく
+        for part in debug_parts:
+            part.unlink(missing_ok=True)
+    row_counts: dict[str, int] = state["row_counts"]
+    first: Optional[list[RecallResult]] = state["first"]
+    debug_header: Optional[pd.DataFrame] = state["debug_header"]
+    adult_counts: list[int] = state["adult_counts"]
+    ped_counts: list[int] = state["ped_counts"]
+    written: set[pathlib.Path] = state["written"]
+    reject_log = rejects.RejectLog()
+    # 郵送履歴に記録するカルテ番号(郵送ごと)
+    adult_sent: list[list[pd.DataFrame]] = [[] for _ in windows]
+    ped_sent: list[list[pd.DataFrame]] = [[] for _ in windows]
+    # 中断前のチャンクの記録を戻す
+    for record in saved.records():
+        reject_log.extend(record["rejects"])
+        for i, ids in record["adult_sent"]:
+            adult_sent[i].append(ids)
+        for i, ids in record["ped_sent"]:
+            ped_sent[i].append(ids)
+    rows_done = state["rows_done"]
+    cache = open_address_cache()
+    if progress is not None and rows_done:
+        progress(rows_done)
+
+    # 小さな入力ファイルは、前に読み込んでいれば変換済みのデータをチャンクに分けて使い、
+    # なければCSVから読み込んで、次の実行のために変換済みのデータを保存する
+    # 大きなファイルはキャッシュを読み書きせず、1チャンク分だけをメモリに保持する
+    small = input_csv_path.stat().st_size <= config.EXPORT_CACHE_STREAM_MAX_BYTES
+    export = cached_export(input_csv_path) if small else None
+    if export is not None:
+        chunks = frame_chunks(export, chunksize)
+    else:
+        chunks = load_csv_chunks(input_csv_path, chunksize)
+    prepared: Optional[list[pd.DataFrame]] = None
+    if (
+        small
+        and export is None
+        and config.EXPORT_CACHE_DIR is not None
+        and state["chunks_done"] == 0
+    ):
+        prepared = []
+
+    for n, chunk in enumerate(chunks):
+        if n < state["chunks_done"]:
+            # 中断前に出力し終えたチャンク
+            continue
+        if cancel is not None and cancel.is_set():
+            # 途中までの出力を郵送に使わないよう、この実行で書き出したファイルを消す
+            if cache is not None:
+                cache.close()
+            if history is not None:
+                history.close()
+            for path in written | set(debug_parts):
+                path.unlink(missing_ok=True)
+            saved.remove()
+            instrument.stop()
+            raise RunCancelled(input_csv_path)
+        if first is None:
+            # 郵便番号と患者氏名の必須カラム確認
+            validate_required_columns(chunk)
+        if prepared is not None:
+            prepare_export(chunk)
+            prepared.append(chunk)
+
+        rejects_before = len(reject_log.frames)
+        results = process_frame(
+            chunk,
+            windows,
+            cache,
+            row_counts,
+            workers,
+            history=None if ignore_history else history,
+            reject_log=reject_log,
+        )
+        chunk_adult_sent = []
+        chunk_ped_sent = []
+
+        # 出力ファイル名は最初のチャンクの期間で決める
+        append = first is not None
+        if first is None:
+            first = [
+                RecallResult(
+                    r.adult.head(0),
+                    r.adult_start,
+                    r.adult_end,
+                    r.ped.head(0) if r.ped is not None else None,
+                    r.ped_start,
+                    r.ped_end,
+                )
+                for r in results
+            ]
+            debug_header = select_debug_columns(results[0].adult).head(0)
+        for i, (result, names) in enumerate(zip(results, first)):
+            path = adult_output_path(output_dir, names.adult_start, names.adult_end)
+            save_to_csv(result.adult, path, append=append)
+            written.add(path)
+            adult_counts[i] += len(result.adult)
+            chunk_adult_sent.append(
+                (i, result.adult.filter([config.PATIENT_ID_COLUMN]))
+            )
+            parts = [(debug_parts[2 * i + 1], result.adult)]
+            if result.ped is not None:
+                path = ped_output_path(output_dir, names.ped_start, names.ped_end)
+                save_to_csv(result.ped, path, append=append)
+                written.add(path)
+                ped_counts[i] += len(result.ped)
+                chunk_ped_sent.append(
+                    (i, result.ped.filter([config.PATIENT_ID_COLUMN]))
+                )
+                parts.append((debug_parts[2 * i], result.ped))
+            for part, df in parts:
+                select_debug_columns(df).to_csv(
+                    part,
+                    index=False,
+                    header=False,
+                    mode="a",
+                    encoding="shift_jis",
+                    errors="replace",
+                )
+
+        for i, ids in chunk_adult_sent:
+            adult_sent[i].append(ids)
+        for i, ids in chunk_ped_sent:
+            ped_sent[i].append(ids)
+        # 増えていく記録はこのチャンクの分だけ追記し、集計中の値と一緒に保存する
+        saved.append(
+            rejects=reject_log.frames[rejects_before:],
+            adult_sent=chunk_adult_sent,
+            ped_sent=chunk_ped_sent,
+        )
+        rows_done += len(chunk)
+        state.update(
+            chunks_done=n + 1,
+            rows_done=rows_done,
+            first=first,
+            debug_header=debug_header,
+        )
+        saved.save(written | set(debug_parts), **state)
+        if progress is not None:
+            progress(rows_done)
+
+    if cache is not None:
+        cache.close()
+    if prepared:
+        store_export(input_csv_path, prepared)
+
+    # デバッグ用CSVを郵送ごとに小児、成人の順に結合
+    with open(output_dir / "debug.csv", "wb") as f:
+        f.write(debug_header.to_csv(index=False).encode("shift_jis", "replace"))
+        for part in debug_parts:
+            if part.exists():
+                f.write(part.read_bytes())
+                part.unlink()
+    reject_log.save(output_dir)
+
+    # 全ての出力が終わってから郵送履歴に記録する
+    record_mailing(history if record_history else None, windows, adult_sent, ped_sent)
+    if history is not None:
+        history.close()
+    saved.remove()
+    save_run_report(
+        report,
+        output_dir,
+        cache,
+        row_counts,
+        input=input_csv_path,
+        next_flags=[w.next_flag for w in windows],
+        windows=[period_label(*w.adult) for w in windows],
+        mode="stream",
+        chunksize=chunksize,
+    )
+
+    # 処理結果の表示
+    print_row_counts(row_counts)
+    reject_log.print_summary()
+    for names, adult_count, ped_count in zip(first, adult_counts, ped_counts):
+        print_summary(
+            names.adult_start,
+            names.adult_end,
+            adult_count,
+            names.ped_start,
+            names.ped_end,
+            ped_count if names.ped is not None else None,
+        )
+    return output_dir
+
+
+if __name__ == "__main__":
+    # 複数の郵送分をまとめて処理する場合の期間
+    windows = None
+    if args.cycles:
+        windows = windows_for_cycles(*args.cycles)
+    elif args.next_flags:
+        windows = windows_for_next_flags(args.next_flags)
+    if args.stream or args.resume:
+        run_stream(
+            args.input,
+            args.next_flag,
+            workers=args.workers,
+            profile=args.profile,
+            windows=windows,
+            ignore_history=args.ignore_history,
+            resume=args.resume,
+            record_history=args.record_history,
+        )
+    else:
+        run(
+            args.input,
+            args.next_flag,
+            args.workers,
+            args.profile,
+            windows,
+            args.ignore_history,
+            args.record_history,
         )
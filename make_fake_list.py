@@ -1,87 +1,343 @@
-import pandas as pd
-import random
+import argparse
+import datetime
+import pathlib
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
 import faker
-from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+
+# ノーザで全項目CSV出力した際の列の並び
+COLUMNS = [
+    "患者カナ氏名",
+    "患者漢字氏名",
+    "カルテ番号",
+    "生年月日",
+    "年齢",
+    "性別",
+    "本人家族区分",
+    "郵便番号",
+    "住所",
+    "電話番号",
+    "保険区分（本人）",
+    "保険区分（家族）",
+    "保険区分（国保）",
+    "保険区分（社保）",
+    "保険区分（公費）",
+    "保険区分（老人/後期）",
+    "保険区分（退職者）",
+    "保険区分（その他自費）",
+    "保険診療開始日",
+    "保険最終来院日",
+    "主担当医師",
+    "原簿コメント",
+    "職業",
+    "統計１",
+    "統計２",
+    "連絡先電話番号",
+]
+
+# 1つずつ選ぶ値の候補(Noneは空欄)
+CHOICES = {
+    "性別": ["男", "女"],
+    "本人家族区分": ["本人", "家族"],
+    "保険区分（本人）": [
+        None,
+        "国保",
+        "社保",
+        "公費",
+        "老人/後期",
+        "退職者",
+        "その他自費",
+    ],
+    "保険区分（家族）": [None, "家族"],
+    "保険区分（国保）": [None, "国保"],
+    "保険区分（社保）": [None, "社保"],
+    "保険区分（公費）": [None, "公費"],
+    "保険区分（老人/後期）": [None, "老人/後期"],
+    "保険区分（退職者）": [None, "退職者"],
+    "保険区分（その他自費）": [None, "その他自費"],
+}
 
-# ダミーデータ生成に使用するライブラリ
-fake = faker.Faker("ja_JP")
+# 不正な値を混ぜる場合に使う値
+MALFORMED_DATES = [
+    "",
+    "不明",
+    "２０２４年 １３月 ０１日",
+    "２０２３年 ０２月 ２９日",
+    "2024/01/01",
+    "２０２４ ０１ ０１",
+]
+MALFORMED_POSTAL_CODES = ["", "000", "123-456", "1234-5678", "〒なし", "abc-defg"]
+
+# 半角を全角に変換する表
+_FULL_WIDTH = str.maketrans(
+    "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ",
+    "０１２３４５６７８９ａｂｃｄｅｆｇｈｉｊｋｌｍｎｏｐｑｒｓｔｕｖｗｘｙｚＡＢＣＤＥＦＧＨＩＪＫＬＭＮＯＰＱＲＳＴＵＶＷＸＹＺ",
+)
 
 
 # 半角を全角に変換する関数
 def to_full_width(text):
-    return text.translate(
-        str.maketrans(
-            "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ",
-            "０１２３４５６７８９ａｂｃｄｅｆｇｈｉｊｋｌｍｎｏｐｑｒｓｔｕｖｗｘｙｚＡＢＣＤＥＦＧＨＩＪＫＬＭＮＯＰＱＲＳＴＵＶＷＸＹＺ",
-        )
+    return text.translate(_FULL_WIDTH)
+
+
+def build_pools(seed: int = 0, size: int = 5000) -> dict[str, np.ndarray]:
+    """
+    Fakerで作る値をあらかじめ `size` 件ずつ作っておく関数。
+
+    行ごとにFakerを呼ぶと遅いので、各列はこの候補からNumPyの乱数で選んで作ります。
+    """
+    fake = faker.Faker("ja_JP")
+    fake.seed_instance(seed)
+    pools = {
+        "name": [fake.name() for _ in range(size)],
+        "zipcode": [fake.zipcode() for _ in range(size)],
+        "address": [fake.address().replace("\n", " ") for _ in range(size)],
+        "phone_number": [fake.phone_number() for _ in range(size)],
+        "job": [fake.job() for _ in range(size)],
+    }
+    return {key: np.array(values, dtype=object) for key, values in pools.items()}
+
+
+def _date_table(first: datetime.date, days: int) -> np.ndarray:
+    """firstから `days` 日分の「２０２４年 ０１月 ０１日」形式の文字列の表"""
+    dates = pd.date_range(first, periods=days, freq="D")
+    return (
+        pd.Series(dates.strftime("%Y年 %m月 %d日"))
+        .str.translate(_FULL_WIDTH)
+        .to_numpy(dtype=object)
     )
 
 
-# 診療の開始日と最終来院日を2024年内でランダムに設定
-def generate_random_date(start_year=2024):
-    start_date = datetime(start_year, 1, 1)
-    end_date = datetime(start_year, 12, 31)
-    return start_date + (end_date - start_date) * random.random()
+def _random_dates(
+    rng: np.random.Generator, rows: int, first: datetime.date, last: datetime.date
+) -> np.ndarray:
+    # 日付の文字列は期間内の日数分だけ作り、乱数で選んだ日を表から引く
+    days = (last - first).days + 1
+    return _date_table(first, days)[rng.integers(0, days, rows)]
+
+
+def _inject(
+    rng: np.random.Generator, values: np.ndarray, ratio: float, candidates: list
+) -> np.ndarray:
+    """valuesのうち `ratio` の割合を candidates の値に置き換える"""
+    if ratio <= 0:
+        return values
+    mask = rng.random(len(values)) < ratio
+    values = values.copy()
+    values[mask] = np.array(candidates, dtype=object)[
+        rng.integers(0, len(candidates), mask.sum())
+    ]
+    return values
+
+
+def generate_chunk(
+    rows: int,
+    first_id: int,
+    seed: np.random.SeedSequence,
+    pools: dict[str, np.ndarray],
+    today: datetime.date,
+    duplicate_ratio: float = 0.0,
+    malformed_date_ratio: float = 0.0,
+    malformed_postal_ratio: float = 0.0,
+) -> pd.DataFrame:
+    """
+    ダミーの患者データを `rows` 行作る関数。
+
+    Args:
+        rows (int): 行数
+        first_id (int): 先頭行のカルテ番号(以降は連番)
+        seed (np.random.SeedSequence): 乱数のシード
+        pools (dict[str, np.ndarray]): `build_pools` で作った候補
+        today (datetime.date): 最終来院日の基準日(この日までの2年間に散らばる)
+        duplicate_ratio (float): 一部の住所に集中させる行の割合(同じ建物・地域の患者が多い状況)
+        malformed_date_ratio (float): 生年月日・最終来院日を不正な値にする行の割合
+        malformed_postal_ratio (float): 郵便番号を不正な値にする行の割合
+
+    Returns:
+        pd.DataFrame: ノーザの全項目CSVと同じ列のデータフレーム
+    """
+    rng = np.random.default_rng(seed)
+    pool_size = len(pools["name"])
 
+    def pick(key: str) -> np.ndarray:
+        return pools[key][rng.integers(0, pool_size, rows)]
 
-# 1人分のダミーデータを生成する関数
-def generate_patient_data():
-    # ランダムな日付（最終来院日）
-    last_visit_date = generate_random_date()
+    # 住所と郵便番号は同じ番号の候補を組にする
+    address_index = rng.integers(0, pool_size, rows)
+    if duplicate_ratio > 0:
+        hot = rng.random(rows) < duplicate_ratio
+        address_index[hot] = rng.integers(0, max(1, pool_size // 100), hot.sum())
 
-    # ランダムに患者データを生成
-    patient_data = {
-        "患者カナ氏名": fake.name(),
-        "患者漢字氏名": fake.name(),
-        "カルテ番号": f"{random.randint(10000, 99999)}",  # ランダムなカルテ番号
-        "生年月日": fake.date_of_birth(minimum_age=2, maximum_age=89).strftime(
-            "%Y年 %m月 %d日"
+    data = {
+        "患者カナ氏名": pick("name"),
+        "患者漢字氏名": pick("name"),
+        "カルテ番号": np.arange(first_id, first_id + rows),
+        "生年月日": _random_dates(
+            rng,
+            rows,
+            today - datetime.timedelta(days=365 * 89),
+            today - datetime.timedelta(days=365 * 2),
         ),
-        "年齢": random.randint(18, 99),
-        "性別": random.choice(["男", "女"]),
-        "本人家族区分": random.choice(["本人", "家族"]),
-        "郵便番号": fake.zipcode(),
-        "住所": fake.address().replace("\n", " "),  # 改行を削除
-        "電話番号": fake.phone_number(),
-        "保険区分（本人）": random.choice(
-            [None, "国保", "社保", "公費", "老人/後期", "退職者", "その他自費"]
+        "年齢": rng.integers(18, 100, rows),
+        "郵便番号": pools["zipcode"][address_index],
+        "住所": pools["address"][address_index],
+        "電話番号": pick("phone_number"),
+        "保険診療開始日": _random_dates(
+            rng, rows, datetime.date(today.year // 10 * 10, 1, 1), today
         ),
-        "保険区分（家族）": random.choice([None, "家族"]),
-        "保険区分（国保）": random.choice([None, "国保"]),
-        "保険区分（社保）": random.choice([None, "社保"]),
-        "保険区分（公費）": random.choice([None, "公費"]),
-        "保険区分（老人/後期）": random.choice([None, "老人/後期"]),
-        "保険区分（退職者）": random.choice([None, "退職者"]),
-        "保険区分（その他自費）": random.choice([None, "その他自費"]),
-        "保険診療開始日": fake.date_this_decade().strftime("%Y年 %m月 %d日"),
-        "保険最終来院日": last_visit_date.strftime("%Y年 %m月 %d日"),
-        "主担当医師": fake.name(),
-        "原簿コメント": "",
-        "職業": fake.job(),
-        "統計１": random.randint(1, 100),
-        "統計２": random.randint(1, 100),
-        "連絡先電話番号": fake.phone_number(),
+        "保険最終来院日": _random_dates(
+            rng, rows, today - datetime.timedelta(days=730), today
+        ),
+        "主担当医師": pick("name"),
+        "原簿コメント": np.full(rows, "", dtype=object),
+        "職業": pick("job"),
+        "統計１": rng.integers(1, 101, rows),
+        "統計２": rng.integers(1, 101, rows),
+        "連絡先電話番号": pick("phone_number"),
     }
+    for column, choices in CHOICES.items():
+        data[column] = np.array(choices, dtype=object)[
+            rng.integers(0, len(choices), rows)
+        ]
+
+    for column in ["生年月日", "保険最終来院日"]:
+        data[column] = _inject(rng, data[column], malformed_date_ratio, MALFORMED_DATES)
+    data["郵便番号"] = _inject(
+        rng, data["郵便番号"], malformed_postal_ratio, MALFORMED_POSTAL_CODES
+    )
+    return pd.DataFrame(data, columns=COLUMNS)
+
+
+# ワーカープロセスで使う候補(プロセスごとに1回だけ受け取る)
+_pools: dict[str, np.ndarray] = {}
+
+
+def _init_worker(pools: dict[str, np.ndarray]):
+    global _pools
+    _pools = pools
+
+
+def _write_chunk(path: pathlib.Path, header: bool, *args, **kwargs) -> pathlib.Path:
+    df = generate_chunk(*args, pools=_pools, **kwargs)
+    df.to_csv(path, index=False, header=header, encoding="shift_jis", errors="replace")
+    return path
 
-    # 生年月日、最終来院日など、全角数字に変換したい項目を全角に変換
-    patient_data["生年月日"] = to_full_width(patient_data["生年月日"])
-    patient_data["保険診療開始日"] = to_full_width(patient_data["保険診療開始日"])
-    patient_data["保険最終来院日"] = to_full_width(patient_data["保険最終来院日"])
 
-    return patient_data
+def generate(
+    rows: int,
+    output: str | pathlib.Path,
+    seed: int = 0,
+    workers: int = 1,
+    chunk_size: int = 100_000,
+    pool_size: int = 5000,
+    duplicate_ratio: float = 0.0,
+    malformed_date_ratio: float = 0.0,
+    malformed_postal_ratio: float = 0.0,
+    today: datetime.date | None = None,
+) -> pathlib.Path:
+    """
+    ダミーの患者データを作り、ノーザと同じShift_JISのCSVとして保存する関数。
 
+    `chunk_size` 行ずつ `workers` 個のプロセスで作って一時ファイルに書き出し、順番に結合します。
+    チャンクごとの乱数はseedから決まるので、プロセス数によらず同じseedなら同じ内容になります。
 
-# 生成する患者数
-num_patients = 1000  # ここでは10人分のダミーデータを生成
+    Args:
+        rows (int): 行数
+        output (str | pathlib.Path): 出力先
+        seed (int): 乱数のシード
+        workers (int): プロセス数
+        chunk_size (int): 1チャンクの行数
+        pool_size (int): Fakerで作っておく候補の数
+        duplicate_ratio (float): 一部の住所に集中させる行の割合
+        malformed_date_ratio (float): 生年月日・最終来院日を不正な値にする行の割合
+        malformed_postal_ratio (float): 郵便番号を不正な値にする行の割合
+        today (datetime.date | None): 日付の基準日。省略時は今日
 
-# ダミーデータをリストに保存
-patients_data = [generate_patient_data() for _ in range(num_patients)]
+    Returns:
+        pathlib.Path: 出力したファイルのパス
+    """
+    output = pathlib.Path(output)
+    today = today or datetime.date.today()
+    pools = build_pools(seed, pool_size)
+    starts = list(range(0, rows, chunk_size))
+    seeds = np.random.SeedSequence(seed).spawn(len(starts))
+    options = {
+        "today": today,
+        "duplicate_ratio": duplicate_ratio,
+        "malformed_date_ratio": malformed_date_ratio,
+        "malformed_postal_ratio": malformed_postal_ratio,
+    }
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with ProcessPoolExecutor(
+            max(1, workers), initializer=_init_worker, initargs=(pools,)
+        ) as executor:
+            futures = [
+                executor.submit(
+                    _write_chunk,
+                    pathlib.Path(tmp_dir) / f"{i}.csv",
+                    i == 0,
+                    min(chunk_size, rows - start),
+                    10000 + start,
+                    seeds[i],
+                    **options,
+                )
+                for i, start in enumerate(starts)
+            ]
+            parts = [future.result() for future in futures]
+        with open(output, "wb") as f:
+            for part in parts:
+                with open(part, "rb") as p:
+                    shutil.copyfileobj(p, f)
+    return output
 
-# DataFrameに変換
-df = pd.DataFrame(patients_data)
 
-# CSVファイルとして保存
-df.to_csv("dummy_patient_data.csv", index=False, encoding="shift_jis")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="テスト用のダミー患者データを作成します"
+    )
+    parser.add_argument("--rows", type=int, default=1000, help="作成する患者数")
+    parser.add_argument("--seed", type=int, default=0, help="乱数のシード")
+    parser.add_argument(
+        "--output",
+        type=pathlib.Path,
+        default=pathlib.Path("dummy_patient_data.csv"),
+        help="出力先",
+    )
+    parser.add_argument("--workers", type=int, default=1, help="プロセス数")
+    parser.add_argument(
+        "--duplicate-ratio",
+        type=float,
+        default=0.0,
+        help="一部の住所に集中させる行の割合(0~1)",
+    )
+    parser.add_argument(
+        "--malformed-date-ratio",
+        type=float,
+        default=0.0,
+        help="生年月日・最終来院日を不正な値にする行の割合(0~1)",
+    )
+    parser.add_argument(
+        "--malformed-postal-ratio",
+        type=float,
+        default=0.0,
+        help="郵便番号を不正な値にする行の割合(0~1)",
+    )
+    args = parser.parse_args()
+
+    path = generate(
+        args.rows,
+        args.output,
+        seed=args.seed,
+        workers=args.workers,
+        duplicate_ratio=args.duplicate_ratio,
+        malformed_date_ratio=args.malformed_date_ratio,
+        malformed_postal_ratio=args.malformed_postal_ratio,
+    )
 
-# データ確認
-print(df.head())
+    # データ確認
+    print(pd.read_csv(path, encoding="shift_jis", nrows=5))
@@ -0,0 +1,164 @@
+import contextlib
+import csv
+import hashlib
+import io
+import os
+import pathlib
+import sqlite3
+import sys
+from typing import Iterable
+
+import pandas as pd
+
+import config
+
+# NGリストの氏名の列名
+_NAME_COLUMN = "氏名"
+# 全角数字→半角の変換表
+ZENKAKU_DIGITS = str.maketrans("０１２３４５６７８９", "0123456789")
+
+
+def normalize_ids(ids: pd.Series) -> pd.Series:
+    """
+    カルテ番号の列を比較用に正規化する関数。
+
+    前後の空白を除き、全角数字を半角にし、数字の前の0を取り除きます(「00123」と「123」を同じ
+    番号として扱う)。数値として読み込まれた列も文字列にそろえます。欠損はNAのままです。
+
+    Examples:
+        >>> normalize_ids(pd.Series([" 00123", "１２３", 123, "A001"])).tolist()
+        ['123', '123', '123', 'A001']
+    """
+    if pd.api.types.is_float_dtype(ids):
+        # 欠損を含む整数列はfloatで読み込まれるので、「123.0」にならないよう整数に戻す
+        ids = ids.astype("Int64")
+    return (
+        ids.astype("string")
+        .str.strip()
+        .str.translate(ZENKAKU_DIGITS)
+        .str.replace(r"^0+(?=\d)", "", regex=True)
+    )
+
+
+def _file_digest(path: pathlib.Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+class NGList:
+    """
+    NGリストのカルテ番号を正規化した集合として保持するクラス。
+
+    正規化済みの番号はCSVの隣のファイル(`<NGリスト>.idx`、SQLite)に保存しておき、CSVの
+    更新日時・サイズが変わったときだけ内容のハッシュを確認して、変わっていれば作り直します。
+    参照のたびに更新日時を確認するので、実行中にCSVが編集されても反映されます。
+
+    Args:
+        path (str | pathlib.Path): NGリストのCSVファイルのパス
+    """
+
+    def __init__(self, path: str | pathlib.Path):
+        self.path = pathlib.Path(path)
+        self.index_path = self.path.with_name(self.path.name + ".idx")
+        self.ids = pd.Index([], dtype="string")
+        self._stat: tuple[int, int] | None = None
+        self.reload_if_changed()
+
+    def _connect(self) -> contextlib.closing:
+        conn = sqlite3.connect(self.index_path)
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS ids (id TEXT PRIMARY KEY);
+            """
+        )
+        return contextlib.closing(conn)
+
+    def _current_stat(self) -> tuple[int, int]:
+        stat = os.stat(self.path)
+        return stat.st_size, stat.st_mtime_ns
+
+    def reload_if_changed(self):
+        """CSVが前回の読み込みから変わっていれば読み込み直す"""
+        stat = self._current_stat()
+        if stat == self._stat:
+            return
+        with self._connect() as conn:
+            meta = dict(conn.execute("SELECT key, value FROM meta"))
+            if meta.get("stat") != repr(stat):
+                digest = _file_digest(self.path)
+                if meta.get("sha256") != digest:
+                    self._rebuild(conn)
+                self._save_meta(conn, stat, digest)
+            ids = [row[0] for row in conn.execute("SELECT id FROM ids")]
+        self.ids = pd.Index(ids, dtype="string")
+        self._stat = stat
+
+    def _rebuild(self, conn: sqlite3.Connection):
+        nglist = pd.read_csv(
+            self.path,
+            encoding="shift_jis",
+            index_col=False,
+            encoding_errors="replace",
+            usecols=[config.PATIENT_ID_COLUMN],
+            dtype=str,
+        )
+        ids = normalize_ids(nglist[config.PATIENT_ID_COLUMN]).dropna().unique()
+        with conn:
+            conn.execute("DELETE FROM ids")
+            conn.executemany("INSERT INTO ids VALUES (?)", ((i,) for i in ids))
+
+    def _save_meta(self, conn: sqlite3.Connection, stat: tuple[int, int], digest: str):
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                [("stat", repr(stat)), ("sha256", digest)],
+            )
+
+    def contains(self, ids: pd.Series) -> pd.Series:
+        """カルテ番号の列のうち、NGリストに含まれるものをTrueとする列を返す"""
+        self.reload_if_changed()
+        return normalize_ids(ids).isin(self.ids)
+
+    def append(self, ids: Iterable[str], name: str = ""):
+        """
+        カルテ番号をNGリストに追加する。
+
+        CSVは書き直さずに末尾へ行を追記し、索引にも追加分だけを登録します。
+        すでに登録済みの番号は追加しません。
+
+        Args:
+            ids (Iterable[str]): 追加するカルテ番号
+            name (str, optional): 氏名の列に記入する値
+        """
+        self.reload_if_changed()
+        new = normalize_ids(pd.Series(list(ids), dtype=object)).dropna().unique()
+        new = [i for i in new if i not in self.ids]
+        if not new:
+            return
+
+        data = self.path.read_bytes()
+        header = next(csv.reader(io.StringIO(data.decode("shift_jis", "replace"))))
+        rows = io.StringIO()
+        writer = csv.writer(rows, lineterminator="\n")
+        for i in new:
+            row = {config.PATIENT_ID_COLUMN: i, _NAME_COLUMN: name}
+            writer.writerow([row.get(c, "") for c in header])
+        with open(self.path, "ab") as f:
+            if data and not data.endswith(b"\n"):
+                f.write(b"\n")
+            f.write(rows.getvalue().encode("shift_jis", "replace"))
+
+        stat = self._current_stat()
+        with self._connect() as conn:
+            with conn:
+                conn.executemany("INSERT INTO ids VALUES (?)", ((i,) for i in new))
+            self._save_meta(conn, stat, _file_digest(self.path))
+        self.ids = self.ids.append(pd.Index(new, dtype="string"))
+        self._stat = stat
+
+
+if __name__ == "__main__":
+    # python ng_list.py 12345 67890 でNGリストにカルテ番号を追加
+    ng_list = NGList(config.NG_LIST_PATH)
+    ng_list.append(sys.argv[1:])
+    print(f"NGリストの件数: {len(ng_list.ids)}")
@@ -1,122 +1,265 @@
-import jusho
+import functools
+import itertools
+import re
+from typing import TYPE_CHECKING, Iterable
+import address_cache
 
-postman: jusho.Jusho = jusho.Jusho()
+if TYPE_CHECKING:
+    import jusho
 
+# jushoの住所データベース。読み込みと接続に時間がかかるので、最初に住所を解決するときに開く
+_postman: "jusho.Jusho | None" = None
 
-def int_to_kanji(num_: str):
+
+def get_postman() -> "jusho.Jusho":
+    """jushoを返す。初回呼び出し時にjushoを読み込み、住所データベースを開く"""
+    global _postman
+    if _postman is None:
+        import jusho
+
+        _postman = jusho.Jusho()
+    return _postman
+
+
+_KANJI_DIGITS = "〇一二三四五六七八九"
+_TO_KANJI_DIGITS = str.maketrans("0123456789", _KANJI_DIGITS)
+
+
+# 住所に出てくる数(丁目・番地・号など)はほぼ4桁までなので、変換した結果を覚えておく
+@functools.cache
+def _kanji_number(num: int) -> str:
+    """0~9999の整数を漢数字(十・百・千の位取り)にする"""
+    if num == 0:
+        return _KANJI_DIGITS[0]
+    res = ""
+    for unit, value in (("千", 1000), ("百", 100), ("十", 10)):
+        digit, num = divmod(num, value)
+        if digit:
+            # 「一千」「一百」「一十」とは書かない
+            res += (_KANJI_DIGITS[digit] if digit > 1 else "") + unit
+    if num:
+        res += _KANJI_DIGITS[num]
+    return res
+
+
+# 数字の並び(全角数字も含む)
+_DIGIT_RUN = re.compile(r"\d+")
+
+
+def int_to_kanji(num_: str) -> str:
+    """数字の文字列を漢数字にする。10000以上は1桁ずつ漢数字にし、数字でなければ空文字"""
     try:
         num = int(num_)
-    except:
+    except ValueError:
         return ""
-    res = ""
-    A = "十百千"
-    num, rem = divmod(num, 10)
-    if not (num and rem == 0):
-        rem_str = str(rem).translate(
-            str.maketrans("0123456789", "〇一二三四五六七八九")
-        )
-        res += rem_str
-    for i, a in enumerate(A):
-        if not num:
-            break
-        num, rem = divmod(num, 10)
-        if num and rem == 0:
-            continue
-        if rem < 2:
-            res += a
-            continue
-        rem_str = str(rem).translate(
-            str.maketrans("0123456789", "〇一二三四五六七八九")
-        )
-        res += A[i]
-        res += rem_str
-    return res[::-1]
-
-
-def trans_int_to_kanji(add):
-    tmp = add
-    ret = ""
-    num = ""
-    for t in tmp:
-        if t.isdigit():
-            num += t
-            continue
-        if num and not t.isdigit():
-            num = int_to_kanji(num)
-            ret += num
-        ret += t
-    return ret
+    if num < 10000:
+        return _kanji_number(num)
+    return str(num).translate(_TO_KANJI_DIGITS)
+
+
+def _to_kanji_with_positions(text: str) -> tuple[str, list[int]]:
+    """
+    文字列の中の数字の並びを全て `int_to_kanji` で漢数字にし(例: 「4日市市1-2」→「四日市市一-二」)、
+    変換後の各位置に対応する変換前の位置も返す。
+
+    位置のリストは変換後の文字列より1つ長く、最後は変換前の文字列の長さです。
+    漢数字の途中の位置は、変換前の数字の並びの先頭に対応させます。
+    """
+    converted = []
+    positions: list[int] = []
+    last = 0
+    for m in _DIGIT_RUN.finditer(text):
+        kanji = int_to_kanji(m.group())
+        converted += [text[last : m.start()], kanji]
+        positions += range(last, m.start())
+        positions += [m.start()] * len(kanji)
+        last = m.end()
+    converted.append(text[last:])
+    positions += range(last, len(text) + 1)
+    return "".join(converted), positions
+
+
+class _SubstringTrie:
+    """名称の部分文字列を引くための接尾辞トライ
+
+    jushoの検索は ``LIKE '%query%'`` の部分一致なので、各名称の全ての接尾辞を登録しておき、
+    住所の先頭から何文字までがいずれかの名称に含まれるかを1回の走査で求める。
+    各ノードにはその部分文字列を含む最初の候補(jushoの検索結果と同じDBの並び順)を保持する。
+    """
+
+    _VALUE = ""  # 1文字のキーと衝突しないノードの値用キー
+
+    def __init__(self):
+        self.root: dict = {}
+
+    def insert(self, name: str, value) -> None:
+        for i in range(len(name)):
+            node = self.root
+            for c in name[i:]:
+                node = node.setdefault(c, {})
+                node.setdefault(self._VALUE, value)
+
+    def longest_prefix(self, text: str) -> tuple[int, object]:
+        """textの先頭からトライに含まれる最長の長さと、そのノードの候補を返す"""
+        node = self.root
+        length = 0
+        value = None
+        for c in text:
+            node = node.get(c)
+            if node is None:
+                break
+            length += 1
+            value = node[self._VALUE]
+        return length, value
+
+
+class AddressIndex:
+    """jushoの都道府県・市区町村データから一度だけ構築する住所のインメモリ索引
+
+    1文字ずつ伸ばしながら ``search_prefectures`` / ``search_cities`` を繰り返していた
+    最長一致の探索を、トライの1回の走査で行う。
+    """
+
+    def __init__(self, postman: "jusho.Jusho"):
+        self.prefectures = _SubstringTrie()
+        for pref in postman.search_prefectures(""):
+            self.prefectures.insert(pref.kanji, pref)
+        self.cities = _SubstringTrie()
+        for city in postman.search_cities(""):
+            self.cities.insert(city.kanji, city)
+
+    def resolve(self, address: str) -> tuple[str, str, str]:
+        """空白・全角数字を処理済みの住所を(都道府県, 市区町村, それ以降)に分解する"""
+        # 都道府県を含むかを判定、含んでいたら削除
+        _, pref = self.prefectures.longest_prefix(address)
+        if pref:
+            pref = pref.kanji
+            if pref in address:
+                address = address.replace(pref, "")
+        # 市区町村の判定
+        ind, city = self.cities.longest_prefix(address)
+        if not city and _DIGIT_RUN.search(address):
+            # 「4日市市」「1宮市」のように、市区町村名の漢数字を数字で書いた住所
+            # 数字から始まる番地などを誤って市区町村にしないよう、名称全体が一致した場合だけ使う
+            converted, positions = _to_kanji_with_positions(address)
+            ind, city = self.cities.longest_prefix(converted)
+            if city and converted.startswith(city.kanji):
+                ind = positions[len(city.kanji)]
+            else:
+                city = None
+        if not city:
+            # 見つからなかった行は呼び出し側で市区町村が"#####"であることから集計する
+            return pref if pref else "#####", "#####", address
+        return city.prefecture.kanji, city.kanji, address[ind:]
+
+
+_address_index: AddressIndex | None = None
+
+
+def get_address_index() -> AddressIndex:
+    """住所索引を返す。初回呼び出し時にjushoのデータから構築する"""
+    global _address_index
+    if _address_index is None:
+        _address_index = AddressIndex(get_postman())
+    return _address_index
+
+
+# 全角・半角の空白を取り除き、全角数字を半角にする変換表
+_ADDRESS_TRANSLATION = str.maketrans(
+    {"　": None, " ": None, **dict(zip("０１２３４５６７８９", "0123456789"))}
+)
+# `normalize_address` の結果を覚えておく件数(常駐するプロセスでも増え続けないよう上限を設ける)
+_NORMALIZE_CACHE_SIZE = 1 << 17
+
+
+@functools.lru_cache(maxsize=_NORMALIZE_CACHE_SIZE)
+def normalize_address(address: str) -> str:
+    """空白を除去し全角数字を半角にした、住所の解決・キャッシュに使うキーを返す"""
+    return address.translate(_ADDRESS_TRANSLATION)
+
+
+# 文字列でない住所(欠損など)を解決しようとした場合の値
+UNRESOLVED = ("#####", "#####", "")
+
+# 1プロセスあたりこの件数に満たない場合は、プロセスを起動するコストの方が大きいので並列化しない
+_MIN_KEYS_PER_WORKER = 1000
+
+
+def _init_worker():
+    """ワーカープロセスごとにjushoを開き直し、住所索引を構築する"""
+    global _postman, _address_index
+    _postman = None
+    _address_index = AddressIndex(get_postman())
+
+
+def _resolve_keys(keys: list[str]) -> list[tuple[str, str, str]]:
+    index = get_address_index()
+    return [index.resolve(key) for key in keys]
+
+
+def resolve_keys(keys: list[str], workers: int = 1) -> list[tuple[str, str, str]]:
+    """正規化済みの住所を解決する。workersが2以上なら複数プロセスで分担する
+
+    Args:
+        keys (list[str]): `normalize_address` で正規化した住所
+        workers (int): プロセス数
+
+    Returns:
+        list[tuple[str, str, str]]: keysと同じ順の(都道府県, 市区町村, それ以降)のリスト
+    """
+    if not keys:
+        # 全てキャッシュにあった場合などは、jushoを開かずに済ませる
+        return []
+    workers = min(workers, len(keys) // _MIN_KEYS_PER_WORKER)
+    if workers <= 1:
+        return _resolve_keys(keys)
+    from concurrent.futures import ProcessPoolExecutor
+
+    # 連続した範囲ごとに分けて、結果をそのままの順で結合する
+    size = -(-len(keys) // workers)
+    shards = [keys[i : i + size] for i in range(0, len(keys), size)]
+    with ProcessPoolExecutor(workers, initializer=_init_worker) as executor:
+        return list(itertools.chain.from_iterable(executor.map(_resolve_keys, shards)))
 
 
 def get_postal_number(address: str) -> tuple[str, str, str]:
+    """住所を解決する。文字列でない場合は処理を止めずに `UNRESOLVED` を返す"""
     if type(address) is not str:
-        print("nanじゃこれ", address, type(address))
-        exit()
-    address = address.replace("　", "")
-    address = address.replace(" ", "")
-    address = address.translate(str.maketrans("０１２３４５６７８９", "0123456789"))
-    # 都道府県を含むかを判定、含んでいたら削除
-    ind = 1
-    pref = postman.search_prefectures(address[:ind])
-    while True:
-        # 候補が見つかる最長の文字列まで検索
-        ind += 1
-        pref = postman.search_prefectures(address[:ind])
-        if not pref:
-            ind -= 1
-            pref = postman.search_prefectures(address[:ind])
-            break
-    if pref:
-        pref = pref[0].kanji
-        if pref in address:
-            address = address.replace(pref, "")
-    # 町域の判定
-    ind = 1
-    city = postman.search_cities(address[:ind])
-
-    while True:
-        ind += 1
-        city = postman.search_cities(address[:ind])
-        if not city or ind > len(address):
-            ind -= 1
-            city = postman.search_cities(address[:ind])
-            break
-    if not city:
-        print("市区町村がみつかりません", pref, address)
-        return pref if pref else "#####", "#####", address
-
-    city = city[0]
-    address = address[ind:]
-    # それ以降
-    address_kanji = trans_int_to_kanji(address)
-
-    ind = 1
-    add = postman.search_addresses(address_kanji[:ind], city=city)
-    while True:
-        ind += 1
-        add = postman.search_addresses(address_kanji[:ind], city=city)
-        if not add or ind > len(address_kanji):
-            ind -= 1
-            add = postman.search_addresses(address_kanji[:ind], city=city)
-            break
-    if not add:
-        try:
-            return pref.kanji if pref else city.prefecture.kanji, city.kanji, address
-        except:
-            print(
-                f"住所を検索できません, add = {add} address = {address}, pref = {pref}, city = {city}"
-            )
-            print(f"便宜的な返り値: {city.prefecture.kanji}, {city.kanji}, {address}")
-            print("この住所で処理を続行します")
-            return city.prefecture.kanji, city.kanji, address
-    add = add[0]
-    return add.prefecture.kanji, add.city.kanji, address
-
-
-def get_address(zip_code) -> jusho.Address | None:
+        return UNRESOLVED
+    return get_address_index().resolve(normalize_address(address))
+
+
+def resolve_many(
+    keys: Iterable[str],
+    cache: address_cache.AddressCache | None = None,
+    workers: int = 1,
+) -> list[tuple[str, str, str]]:
+    """正規化済みの住所の列をまとめて解決する。同じ住所は一度だけ解決する
+
+    Args:
+        keys (Iterable[str]): `normalize_address` で正規化した住所の列
+        cache (AddressCache | None): 指定した場合、正規化した住所をキーに解決結果を再利用・保存する
+        workers (int): キャッシュになかった住所の解決に使うプロセス数
+
+    Returns:
+        list[tuple[str, str, str]]: 入力と同じ順の(都道府県, 市区町村, それ以降)のリスト。
+            文字列でない住所(欠損など)は処理を止めずに `UNRESOLVED` になります
+    """
+    keys = list(keys)
+    unique_keys = list(dict.fromkeys(key for key in keys if type(key) is str))
+    resolved = cache.get_many(unique_keys) if cache is not None else {}
+    missing = [key for key in unique_keys if key not in resolved]
+    new = dict(zip(missing, resolve_keys(missing, workers)))
+    if cache is not None and new:
+        cache.put_many(new)
+    resolved.update(new)
+    return [resolved[key] if type(key) is str else UNRESOLVED for key in keys]
+
+
+def get_address(zip_code) -> "jusho.Address | None":
     if zip_code == "0000000":
         return ["#####", "", ""]
-    ret = postman.by_zip_code(zip_code)
+    ret = get_postman().by_zip_code(zip_code)
     if not ret:
         print("郵便番号が存在しません")
         return ["#####郵便番号住所不明", "#####", "#####"]
@@ -0,0 +1,91 @@
+import pathlib
+from typing import Iterable, Optional
+
+import pandas as pd
+
+import config
+
+# rejects.csvの列
+ROW: str = "行"  # 入力ファイルのデータの行番号(ヘッダを除いて1から)
+PATIENT_ID: str = "カルテ番号"
+REASON: str = "理由"
+VALUE: str = "値"  # 処理できなかった元の値
+
+COLUMNS: list[str] = [ROW, PATIENT_ID, REASON, VALUE]
+
+
+class RejectLog:
+    """
+    住所を解決できなかった行などを、処理を止めずに集めておくクラス。
+
+    集めた行は `save` で出力フォルダの `rejects.csv` に書き出します。画面には1行ずつ
+    表示せず、理由ごとに最初の `max_examples` 件だけを表示し、残りは `print_summary` で
+    件数だけを表示します。
+
+    Args:
+        max_examples (int): 理由ごとに画面に表示する行数
+    """
+
+    def __init__(self, max_examples: int = config.REJECT_LOG_EXAMPLES):
+        self.max_examples = max_examples
+        self.frames: list[pd.DataFrame] = []
+        self.counts: dict[str, int] = {}
+
+    def add(
+        self,
+        df: pd.DataFrame,
+        reason: str,
+        values: Optional[Iterable] = None,
+    ):
+        """
+        dfの行を理由reasonで記録する。
+
+        Args:
+            df (pd.DataFrame): 記録する行(インデックスは読み込んだときの行の位置)
+            reason (str): 処理できなかった理由
+            values (Iterable, optional): 行ごとの元の値。省略時は住所の列
+        """
+        if df.empty:
+            return
+        if values is None:
+            values = df[config.ADDRESS_COLUMN]
+        rejected = pd.DataFrame(
+            {
+                ROW: df.index + 1,
+                PATIENT_ID: df.get(config.PATIENT_ID_COLUMN),
+                REASON: reason,
+                VALUE: list(values),
+            },
+            columns=COLUMNS,
+        )
+        shown = self.counts.get(reason, 0)
+        for row in rejected.head(max(0, self.max_examples - shown)).itertuples(
+            index=False
+        ):
+            print(f"[住所未解決] {reason}: {row[3]} ({ROW}{row[0]})")
+        self.counts[reason] = shown + len(rejected)
+        self.frames.append(rejected)
+
+    def extend(self, frames: Iterable[pd.DataFrame]):
+        """`frames` と同じ形式の記録を、画面に表示せずに追加する(途中経過からの再開用)"""
+        for rejected in frames:
+            for reason, count in rejected[REASON].value_counts(sort=False).items():
+                self.counts[reason] = self.counts.get(reason, 0) + int(count)
+            self.frames.append(rejected)
+
+    def __len__(self) -> int:
+        return sum(self.counts.values())
+
+    def print_summary(self):
+        """理由ごとの件数を表示する"""
+        for reason, count in self.counts.items():
+            print(f"[住所未解決] {reason}: {count}件")
+
+    def save(self, output_dir: pathlib.Path) -> pathlib.Path:
+        """記録した行を行番号の順に `rejects.csv` に書き出す(0件でもヘッダだけ書き出す)"""
+        path = output_dir / "rejects.csv"
+        df = pd.concat(self.frames) if self.frames else pd.DataFrame(columns=COLUMNS)
+        df.sort_values(ROW, kind="stable").to_csv(
+            path, index=False, encoding="shift_jis", errors="replace"
+        )
+        return path
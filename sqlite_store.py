@@ -0,0 +1,43 @@
+import pathlib
+import sqlite3
+from typing import Iterator, Sequence
+
+# SQLiteのプレースホルダ数の上限(古いバージョンでは999)を超えないように分割する
+_CHUNK_SIZE = 500
+
+
+def chunked(values: Sequence, size: int = _CHUNK_SIZE) -> Iterator[Sequence]:
+    """valuesを、1つのSQL文のプレースホルダに収まる数ずつ順に返す"""
+    for i in range(0, len(values), size):
+        yield values[i : i + size]
+
+
+def placeholders(values: Sequence) -> str:
+    """`IN (...)` に使う、valuesの数だけの「?」をカンマでつないだ文字列"""
+    return ",".join("?" * len(values))
+
+
+class SQLiteStore:
+    """
+    SQLiteのファイルに保存するクラスの共通部分。
+
+    保存先のフォルダがなければ作成してファイルに接続し、`close` またはwith文の終わりで
+    接続を閉じます。
+
+    Args:
+        path (str | pathlib.Path): 保存するファイルのパス
+    """
+
+    def __init__(self, path: str | pathlib.Path):
+        path = pathlib.Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(path)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,86 @@
+import os
+import pathlib
+import tempfile
+import unittest
+
+import checkpoint
+from checkpoint import Checkpoint, run_key
+
+
+class CheckpointTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = pathlib.Path(tmp.name)
+        self.output_dir = self.root / "20261017_input"
+        self.output_dir.mkdir()
+        self.output = self.output_dir / "output.csv"
+        self.rejects = self.output_dir / "rejects.csv"
+
+    def interrupted_run(self, key: str = "key") -> Checkpoint:
+        """1チャンク目を保存した後、2チャンク目の途中で止まった実行"""
+        saved = Checkpoint(self.output_dir, key)
+        self.output.write_text("header\nrow1\n")
+        saved.append(rejects=["a"])
+        saved.save([self.output, self.rejects], rows=1)
+
+        with open(self.output, "a") as f:
+            f.write("row2\nro")
+        self.rejects.write_text("b\n")
+        saved.append(rejects=["b"])
+        return saved
+
+    def test_resume_truncates_outputs_and_journal(self):
+        self.interrupted_run()
+        resumed = Checkpoint(self.output_dir, "key")
+        self.assertEqual(resumed.load(), {"rows": 1})
+        self.assertEqual(self.output.read_text(), "header\nrow1\n")
+        # 保存時になかったファイルは削除する
+        self.assertFalse(self.rejects.exists())
+        self.assertEqual(list(resumed.records()), [{"rejects": ["a"]}])
+
+        # 再開後に追記した記録は、切り詰めた位置から続く
+        resumed.append(rejects=["c"])
+        self.assertEqual(
+            list(resumed.records()), [{"rejects": ["a"]}, {"rejects": ["c"]}]
+        )
+
+    def test_different_key_does_not_touch_outputs(self):
+        self.interrupted_run()
+        self.assertIsNone(Checkpoint(self.output_dir, "other").load())
+        self.assertEqual(self.output.read_text(), "header\nrow1\nrow2\nro")
+        self.assertEqual(len(list(Checkpoint(self.output_dir, "other").records())), 2)
+
+    def test_missing_output_cannot_resume(self):
+        self.interrupted_run()
+        self.output.unlink()
+        self.assertIsNone(Checkpoint(self.output_dir, "key").load())
+
+    def test_remove(self):
+        saved = self.interrupted_run()
+        saved.remove()
+        self.assertFalse(saved.path.exists())
+        self.assertFalse(saved.journal.exists())
+
+    def test_run_key_follows_input_file(self):
+        input_path = self.root / "input.csv"
+        input_path.write_text("a\n")
+        key = run_key(input_path, [], 1000, False)
+        self.assertEqual(run_key(input_path, [], 1000, False), key)
+        self.assertNotEqual(run_key(input_path, [], 500, False), key)
+        self.assertNotEqual(run_key(input_path, [], 1000, True), key)
+        stat = input_path.stat()
+        os.utime(input_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+        self.assertNotEqual(run_key(input_path, [], 1000, False), key)
+
+    def test_find(self):
+        self.interrupted_run()
+        found = checkpoint.find(self.root, pathlib.Path("input.csv"), "key")
+        self.assertIsNotNone(found)
+        output_dir, _, state = found
+        self.assertEqual((output_dir, state), (self.output_dir, {"rows": 1}))
+        self.assertIsNone(checkpoint.find(self.root, pathlib.Path("other.csv"), "key"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import datetime
+import unittest
+
+import pandas as pd
+
+from date_series import age_bands
+
+
+def bands(birthdays: list, thresholds: list[int], *references: datetime.date):
+    return age_bands(
+        pd.Series(pd.to_datetime(birthdays)), thresholds, list(references)
+    ).tolist()
+
+
+class AgeBandsTest(unittest.TestCase):
+    def test_birthday_is_counted_on_the_day(self):
+        self.assertEqual(
+            bands(["2014-10-17"], [12], datetime.date(2026, 10, 16)), [[0]]
+        )
+        self.assertEqual(
+            bands(["2014-10-17"], [12], datetime.date(2026, 10, 17)), [[1]]
+        )
+
+    def test_leap_day_birthday(self):
+        references = [
+            datetime.date(2024, 2, 28),
+            datetime.date(2024, 2, 29),
+            datetime.date(2025, 2, 28),
+            datetime.date(2025, 3, 1),
+        ]
+        # 2/29生まれは、うるう年でない年は3/1に年を取る
+        self.assertEqual(
+            bands(["2012-02-29"], [12, 13], *references), [[0], [1], [1], [2]]
+        )
+
+    def test_thresholds_and_references(self):
+        self.assertEqual(
+            bands(
+                ["2020-01-01", "1990-06-30", "1960-12-31", None],
+                [12, 65],
+                datetime.date(2025, 12, 30),
+                datetime.date(2025, 12, 31),
+            ),
+            [[0, 1, 1, -1], [0, 1, 2, -1]],
+        )
+
+    def test_matches_pandas_date_arithmetic(self):
+        birthdays = pd.Series(pd.date_range("1999-12-25", "2000-03-05"))
+        reference = datetime.date(2012, 2, 29)
+        expected = [
+            reference.year
+            - b.year
+            - ((reference.month, reference.day) < (b.month, b.day))
+            >= 12
+            for b in birthdays
+        ]
+        self.assertEqual(
+            age_bands(birthdays, [12], [reference])[0].tolist(),
+            [int(e) for e in expected],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import os
+import pathlib
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+import config
+import export_cache
+from export_cache import ExportCache, cache_key
+
+
+class ExportCacheTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = pathlib.Path(tmp.name)
+        self.cache = ExportCache(self.tmp / "cache", max_files=2)
+
+    def write(self, name: str, text: str) -> pathlib.Path:
+        path = self.tmp / name
+        path.write_text(text, encoding="shift_jis")
+        return path
+
+    def age(self, key: str, seconds: int):
+        """キャッシュのファイルの更新日時(最後に使った日時)を古くする"""
+        for path in self.cache._paths(key):
+            if path.exists():
+                stat = path.stat()
+                os.utime(
+                    path, ns=(stat.st_atime_ns, stat.st_mtime_ns - seconds * 10**9)
+                )
+
+    def test_key_depends_on_content_and_settings(self):
+        key = cache_key(self.write("a.csv", "カルテ番号\n1\n"))
+        # パスによらず、内容が同じなら同じキーにする
+        self.assertEqual(cache_key(self.write("b.csv", "カルテ番号\n1\n")), key)
+        self.assertNotEqual(cache_key(self.write("c.csv", "カルテ番号\n2\n")), key)
+        # 列名の設定を変えた場合は、同じ内容でも別のキーにする
+        with mock.patch.object(config, "ADDRESS_COLUMN", "現住所"):
+            self.assertNotEqual(cache_key(self.write("d.csv", "カルテ番号\n1\n")), key)
+
+    def test_find_requires_same_stat(self):
+        path = self.write("a.csv", "カルテ番号\n1\n")
+        key = cache_key(path)
+        self.cache.put(key, pd.DataFrame({"a": [1]}))
+        self.cache.remember(path, key)
+        self.assertEqual(self.cache.find(path), key)
+        pd.testing.assert_frame_equal(self.cache.get(key), pd.DataFrame({"a": [1]}))
+
+        stat = path.stat()
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+        self.assertIsNone(self.cache.find(path))
+
+    def test_evicts_least_recently_used(self):
+        keys = []
+        for i in range(3):
+            path = self.write(f"{i}.csv", f"カルテ番号\n{i}\n")
+            keys.append(cache_key(path))
+            self.cache.put(keys[-1], pd.DataFrame({"a": [i]}))
+            self.cache.remember(path, keys[-1])
+            if i == 1:
+                self.age(keys[0], 20)
+                self.age(keys[1], 30)
+                # 読み込んだキャッシュは最後に使われたものとして扱う
+                self.cache.get(keys[0])
+
+        self.assertIsNotNone(self.cache.get(keys[0]))
+        self.assertIsNone(self.cache.get(keys[1]))
+        self.assertIsNotNone(self.cache.get(keys[2]))
+        # 表のファイルは件数に数えず、削除したキャッシュの組は表から除く
+        self.assertTrue((self.cache.directory / export_cache._INDEX_FILENAME).exists())
+        self.assertEqual(
+            sorted(self.cache._load_index().values()), sorted([keys[0], keys[2]])
+        )
+        self.assertIsNone(self.cache.find(self.tmp / "1.csv"))
+
+
+if __name__ == "__main__":
+    unittest.main()
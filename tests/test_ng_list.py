@@ -0,0 +1,72 @@
+import os
+import pathlib
+import tempfile
+import unittest
+
+import pandas as pd
+
+import config
+from ng_list import NGList, normalize_ids
+
+
+class NormalizeIdsTest(unittest.TestCase):
+    def test_strings(self):
+        self.assertEqual(
+            normalize_ids(
+                pd.Series([" 00123 ", "０１２３", "123", "0", "000", "A001", "12-03"])
+            ).tolist(),
+            ["123", "123", "123", "0", "0", "A001", "12-03"],
+        )
+
+    def test_missing_values_stay_missing(self):
+        ids = normalize_ids(pd.Series(["001", None], dtype=object))
+        self.assertEqual(ids[0], "1")
+        self.assertTrue(pd.isna(ids[1]))
+
+    def test_numeric_columns(self):
+        self.assertEqual(normalize_ids(pd.Series([123, 45])).tolist(), ["123", "45"])
+        # 欠損を含む整数列はfloatで読み込まれるが、「123.0」にはしない
+        ids = normalize_ids(pd.Series([123.0, None]))
+        self.assertEqual(ids[0], "123")
+        self.assertTrue(pd.isna(ids[1]))
+
+
+class NGListTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = pathlib.Path(tmp.name) / "nglist.csv"
+        self.write(["00001", "０２", "A3"])
+
+    def write(self, ids: list[str]):
+        rows = [f"氏名,{config.PATIENT_ID_COLUMN}"] + [f"テスト,{i}" for i in ids]
+        self.path.write_bytes(("\n".join(rows) + "\n").encode("shift_jis"))
+
+    def test_contains_normalizes_both_sides(self):
+        ng_list = NGList(self.path)
+        self.assertEqual(
+            ng_list.contains(pd.Series(["1", "002", " A3", "3"])).tolist(),
+            [True, True, True, False],
+        )
+
+    def test_reloads_when_csv_changes(self):
+        ng_list = NGList(self.path)
+        self.write(["00001", "000009"])
+        # 同じ秒のうちに書き換えても変更に気付くよう、更新日時をずらす
+        stat = self.path.stat()
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+        self.assertEqual(
+            ng_list.contains(pd.Series(["2", "9"])).tolist(), [False, True]
+        )
+
+    def test_append_skips_registered_ids(self):
+        ng_list = NGList(self.path)
+        ng_list.append(["001", "０４", "4"])
+        self.assertEqual(sorted(ng_list.ids), ["1", "2", "4", "A3"])
+        # 索引から読み込み直しても同じ内容になる
+        self.assertEqual(sorted(NGList(self.path).ids), ["1", "2", "4", "A3"])
+        self.assertEqual(self.path.read_bytes().count(b"\n"), 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import csv
+import pathlib
+import unittest
+
+import postal_number
+
+DUMMY_DATA = pathlib.Path(__file__).parent.parent / "dummy_patient_data.csv"
+
+
+def search_resolve(postman, address: str) -> tuple[str, str, str]:
+    """1文字ずつ伸ばしながら ``search_prefectures`` / ``search_cities`` を繰り返す、索引を使わない解決"""
+    ind = 1
+    while postman.search_prefectures(address[: ind + 1]) and ind < len(address):
+        ind += 1
+    pref = postman.search_prefectures(address[:ind])
+    if pref:
+        pref = pref[0].kanji
+        if pref in address:
+            address = address.replace(pref, "")
+    ind = 1
+    while postman.search_cities(address[: ind + 1]) and ind < len(address):
+        ind += 1
+    city = postman.search_cities(address[:ind])
+    if not city:
+        return pref if pref else "#####", "#####", address
+    return city[0].prefecture.kanji, city[0].kanji, address[ind:]
+
+
+class SubstringTrieTest(unittest.TestCase):
+    def test_longest_prefix_matches_any_substring(self):
+        trie = postal_number._SubstringTrie()
+        trie.insert("四日市市", "yokkaichi")
+        trie.insert("市川市", "ichikawa")
+        self.assertEqual(trie.longest_prefix("日市市桜町"), (3, "yokkaichi"))
+        self.assertEqual(trie.longest_prefix("市川市八幡"), (3, "ichikawa"))
+        self.assertEqual(trie.longest_prefix("桜町"), (0, None))
+
+    def test_first_inserted_value_wins(self):
+        # jushoの検索結果と同じく、同じ部分文字列を含む名称はDBの並び順で最初のものを使う
+        trie = postal_number._SubstringTrie()
+        trie.insert("府中市", "tokyo")
+        trie.insert("府中市", "hiroshima")
+        self.assertEqual(trie.longest_prefix("府中市"), (3, "tokyo"))
+
+
+class AddressIndexTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.postman = postal_number.get_postman()
+        cls.index = postal_number.get_address_index()
+
+    def test_matches_search_cities(self):
+        with open(DUMMY_DATA, encoding="cp932", newline="") as f:
+            addresses = [row["住所"] for row in csv.DictReader(f)][:100]
+        # 空文字列の検索(``LIKE '%%'``)は全件に一致するので、都道府県だけの住所は比べない
+        addresses += ["府中市", "京都府京都市", "存在しない町1-2-3"]
+        for address in addresses:
+            key = postal_number.normalize_address(address)
+            with self.subTest(address=address):
+                self.assertEqual(
+                    self.index.resolve(key), search_resolve(self.postman, key)
+                )
+
+    def test_city_name_written_with_digits(self):
+        self.assertEqual(
+            self.index.resolve("三重県4日市市安島1-2-3"),
+            ("三重県", "四日市市", "安島1-2-3"),
+        )
+        # 数字から始まる番地を市区町村にしない
+        self.assertEqual(self.index.resolve("1-2-3"), ("#####", "#####", "1-2-3"))
+
+    def test_parallel_matches_serial(self):
+        with open(DUMMY_DATA, encoding="cp932", newline="") as f:
+            keys = [
+                postal_number.normalize_address(row["住所"])
+                for row in csv.DictReader(f)
+            ]
+        keys = (keys * (2 * postal_number._MIN_KEYS_PER_WORKER // len(keys) + 1))[
+            : 2 * postal_number._MIN_KEYS_PER_WORKER
+        ]
+        self.assertEqual(
+            postal_number.resolve_keys(keys, workers=2),
+            postal_number.resolve_keys(keys, workers=1),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
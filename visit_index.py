@@ -0,0 +1,109 @@
+import datetime
+import os
+import pathlib
+import zipfile
+from typing import Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+import config
+import datetimeutil
+
+# 期間は(開始日, 終了日)で、どちらの日も含む
+Period = tuple[datetime.datetime, datetime.datetime]
+
+
+def recall_periods(now: datetime.datetime, next_flag: int = 0) -> dict[str, Period]:
+    """`now` に実行した場合の成人・小児の最終来院日の期間を返す"""
+    return {
+        "adult": datetimeutil.get_start_and_end_day_2(
+            now, -config.RECALL_INTERVAL_MONTHS, next_flag
+        ),
+        "ped": datetimeutil.get_start_and_end_day_2(
+            now, -config.PED_RECALL_INTERVAL_MONTHS, next_flag
+        ),
+    }
+
+
+def input_key(path: str | pathlib.Path) -> str:
+    """入力ファイルのパス・サイズ・更新日時から、保存した索引を使えるか判定する文字列を返す"""
+    stat = os.stat(path)
+    return (
+        f"{pathlib.Path(path).resolve()}:{stat.st_size}:{stat.st_mtime_ns}:"
+        f"{config.LAST_VISIT_COLUMN}"
+    )
+
+
+class LastVisitIndex:
+    """
+    最終来院日で行を並べ替えた索引。期間に入る行を二分探索で求めるクラス。
+
+    日付を一度だけ並べ替えて、元の行の位置と組にして保持します。期間ごとの絞り込みは
+    `numpy.searchsorted` で開始日・終了日の位置を求め、その間の行を取り出すだけなので、
+    同じデータに何度も期間を問い合わせる場合に列全体を比較し直す必要がありません。
+    最終来院日が空欄・不正な行はどの期間にも入りません。
+
+    Args:
+        dates (pd.Series): 日付型に変換済みの最終来院日の列
+    """
+
+    def __init__(self, dates: pd.Series):
+        values = dates.to_numpy(dtype="datetime64[ns]")
+        positions = np.flatnonzero(~np.isnat(values))
+        order = np.argsort(values[positions], kind="stable")
+        self.dates = values[positions][order]
+        self.positions = positions[order]
+        self.length = len(values)
+
+    def positions_in(self, periods: Iterable[Period]) -> np.ndarray:
+        """いずれかの期間に入る行の位置を、元の並び順で返す"""
+        found = []
+        for start, end in periods:
+            lo = np.searchsorted(self.dates, np.datetime64(start, "ns"), side="left")
+            hi = np.searchsorted(self.dates, np.datetime64(end, "ns"), side="right")
+            found.append(self.positions[lo:hi])
+        if not found:
+            return np.empty(0, dtype=np.intp)
+        # 期間が重なる場合に同じ行を2回返さないよう、重複を除いて元の順に並べる
+        return np.unique(np.concatenate(found))
+
+    def mask(self, periods: Iterable[Period]) -> np.ndarray:
+        """いずれかの期間に入る行をTrueとする配列を返す"""
+        mask = np.zeros(self.length, dtype=bool)
+        mask[self.positions_in(periods)] = True
+        return mask
+
+    def save(self, path: str | pathlib.Path, key: str):
+        """
+        索引をファイルに保存する。keyは読み込み時に入力が変わっていないかの確認に使う。
+        書き込みの途中で止まったり、同時に保存したりしても壊れないよう、プロセスごとの
+        一時ファイルに書いてから置き換えます。
+        """
+        path = pathlib.Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            np.savez(
+                f,
+                key=np.array(key),
+                dates=self.dates,
+                positions=self.positions,
+                length=np.array(self.length),
+            )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str | pathlib.Path, key: str) -> Optional["LastVisitIndex"]:
+        """保存した索引を読み込む。ファイルがない・壊れている、またはkeyが違う場合はNone"""
+        try:
+            with np.load(path) as data:
+                if str(data["key"]) != key:
+                    return None
+                index = cls.__new__(cls)
+                index.dates = data["dates"]
+                index.positions = data["positions"]
+                index.length = int(data["length"])
+        except (OSError, KeyError, ValueError, EOFError, zipfile.BadZipFile):
+            return None
+        return index
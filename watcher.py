@@ -0,0 +1,300 @@
+import argparse
+import datetime
+import pathlib
+import shutil
+import signal
+import threading
+import traceback
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+import config
+
+# 処理対象にする入力ファイルの拡張子
+INPUT_SUFFIXES = {".csv", ".txt"}
+
+
+def _warm_up():
+    """ワーカープロセスの起動時に、main.pyの読み込み・住所索引の構築・NGリストの読み込みを済ませる"""
+    # Ctrl+Cは親プロセスだけが受け取り、処理中のファイルは最後まで処理する
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    import main
+    import postal_number
+    import zip_table
+
+    postal_number.get_address_index()
+    zip_table.get_table()
+    if pathlib.Path(config.NG_LIST_PATH).exists():
+        main.get_ng_list()
+
+
+def _process_file(
+    path: pathlib.Path,
+    next_flag: int,
+    stream: bool,
+    ignore_history: bool = False,
+    record_history: bool = False,
+) -> pathlib.Path:
+    import main
+
+    options = dict(ignore_history=ignore_history, record_history=record_history)
+    if stream:
+        # 監視を止めたときに処理中だったファイルは、次に起動したときに続きから処理する
+        return main.run_stream(path, next_flag, resume=True, **options)
+    return main.run(path, next_flag, **options)
+
+
+def _timestamp() -> str:
+    return datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+
+
+def _log(message: str):
+    print(f"[{datetime.datetime.now():%Y-%m-%d %H:%M:%S}] {message}", flush=True)
+
+
+class Watcher:
+    """
+    フォルダに置かれた入力ファイルを、常駐したワーカープロセスで順に処理するクラス。
+
+    ワーカープロセスは起動時に住所索引とNGリストを読み込んでおき、以降のファイルでは
+    読み込み済みのものを再利用します。同時に処理するファイルは `max_jobs` 件までで、
+    それ以上のファイルはフォルダに置かれたまま順番を待ちます。
+    書き込み途中のファイルを読まないよう、サイズと更新日時が前回の確認から変わっていない
+    ファイルだけを処理します。処理したファイルは `processed` に、失敗したファイルは
+    エラー内容(`<ファイル名>.error.txt`)と一緒に `quarantine` に移動し、監視は続けます。
+    ワーカープロセスが異常終了したときは、そのとき処理中だったファイルを1件ずつ処理し直し、
+    単独でも異常終了したファイルだけを `quarantine` に移動します。
+
+    watchdogがインストールされていればフォルダの変更通知(Linuxではinotify)で、なければ
+    `poll_seconds` 秒ごとにフォルダを確認します。
+
+    Args:
+        folder (pathlib.Path): 監視するフォルダ
+        next_flag (int): 最終来院日のフィルタリングに使用するタイムオフセット
+        max_jobs (int): 同時に処理するファイル数(ワーカープロセス数)
+        poll_seconds (float): フォルダを確認する間隔(秒)
+        stream (bool): Trueの場合 `main.run_stream` で処理する
+        ignore_history (bool): Trueの場合、郵送履歴で送付済みの患者も除外せずに出力する
+        record_history (bool): Trueの場合、出力した患者を送付済みとして郵送履歴に記録する
+    """
+
+    def __init__(
+        self,
+        folder: pathlib.Path,
+        next_flag: int = 0,
+        max_jobs: int = config.WATCH_MAX_JOBS,
+        poll_seconds: float = config.WATCH_POLL_SECONDS,
+        stream: bool = False,
+        ignore_history: bool = False,
+        record_history: bool = False,
+    ):
+        self.folder = pathlib.Path(folder)
+        self.processed_dir = self.folder / "processed"
+        self.quarantine_dir = self.folder / "quarantine"
+        self.next_flag = next_flag
+        self.max_jobs = max(1, max_jobs)
+        self.poll_seconds = poll_seconds
+        self.stream = stream
+        self.ignore_history = ignore_history
+        self.record_history = record_history
+        self.stop_event = threading.Event()
+        self._wake = threading.Event()
+        self._seen: dict[pathlib.Path, tuple[int, int]] = {}
+        self._running: dict[Future, pathlib.Path] = {}
+        # ワーカーの異常終了に巻き込まれ、単独で処理し直すファイル
+        self._suspects: set[pathlib.Path] = set()
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _start_executor(self):
+        self._executor = ProcessPoolExecutor(self.max_jobs, initializer=_warm_up)
+
+    def _start_observer(self):
+        """watchdogがあれば、フォルダに変更があったときにすぐ確認するよう通知を受け取る"""
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            _log(f"watchdogがないため、{self.poll_seconds}秒ごとにフォルダを確認します")
+            return None
+
+        wake = self._wake
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                wake.set()
+
+        observer = Observer()
+        observer.schedule(Handler(), str(self.folder), recursive=False)
+        observer.start()
+        return observer
+
+    def ready_files(self) -> list[pathlib.Path]:
+        """処理中でなく、前回の確認から書き込みが終わっているファイルを古い順に返す"""
+        running = set(self._running.values())
+        seen: dict[pathlib.Path, tuple[int, int]] = {}
+        ready = []
+        for path in self.folder.iterdir():
+            if not path.is_file() or path.suffix.lower() not in INPUT_SUFFIXES:
+                continue
+            if path in running:
+                continue
+            stat = path.stat()
+            seen[path] = (stat.st_size, stat.st_mtime_ns)
+            if self._seen.get(path) == seen[path]:
+                ready.append(path)
+        self._seen = seen
+        return sorted(ready, key=lambda p: self._seen[p][1])
+
+    def _move(self, path: pathlib.Path, folder: pathlib.Path) -> pathlib.Path:
+        folder.mkdir(exist_ok=True)
+        destination = folder / f"{_timestamp()}_{path.name}"
+        shutil.move(path, destination)
+        return destination
+
+    def _quarantine(self, path: pathlib.Path, error: BaseException):
+        destination = self._move(path, self.quarantine_dir)
+        destination.with_name(destination.name + ".error.txt").write_text(
+            "".join(traceback.format_exception(error)), encoding="utf-8"
+        )
+        _log(f"失敗: {path.name} → {destination} ({error!r})")
+
+    def _finish(
+        self,
+        future: Future,
+        crashed: list[tuple[pathlib.Path, BrokenProcessPool]],
+    ):
+        path = self._running.pop(future)
+        try:
+            output_dir = future.result()
+        except BrokenProcessPool as e:
+            crashed.append((path, e))
+            return
+        except Exception as e:
+            self._quarantine(path, e)
+        else:
+            self._move(path, self.processed_dir)
+            _log(f"完了: {path.name} → {output_dir}")
+        self._suspects.discard(path)
+
+    def _collect(self, futures: set[Future], restart: bool = True):
+        crashed: list[tuple[pathlib.Path, BrokenProcessPool]] = []
+        for future in futures:
+            self._finish(future, crashed)
+        if not crashed:
+            return
+        # プールが壊れると処理中のファイルはすべて失敗するので、残りもまとめて回収する
+        for future in list(self._running):
+            self._finish(future, crashed)
+        if len(crashed) == 1:
+            # 単独で処理していたファイルが異常終了の原因
+            path, error = crashed[0]
+            self._suspects.discard(path)
+            self._quarantine(path, error)
+        else:
+            # どのファイルが原因か分からないので、フォルダに残したまま1件ずつ処理し直す
+            for path, _ in crashed:
+                self._suspects.add(path)
+                _log(f"ワーカーが異常終了したため、単独で処理し直します: {path.name}")
+        if restart:
+            # ワーカーが異常終了した場合は、プロセスを起動し直して監視を続ける
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._start_executor()
+
+    def serve(self):
+        """`stop_event` がセットされるまでフォルダを監視して処理を続ける"""
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self._start_executor()
+        observer = self._start_observer()
+        _log(f"{self.folder}の監視を開始しました")
+        try:
+            while not self.stop_event.is_set():
+                for path in self.ready_files():
+                    if len(self._running) >= self.max_jobs:
+                        break
+                    if self._suspects.intersection(self._running.values()):
+                        break
+                    if path in self._suspects and self._running:
+                        continue
+                    _log(f"処理開始: {path.name}")
+                    future = self._executor.submit(
+                        _process_file,
+                        path,
+                        self.next_flag,
+                        self.stream,
+                        self.ignore_history,
+                        self.record_history,
+                    )
+                    self._running[future] = path
+
+                if self._running:
+                    done, _ = wait(
+                        self._running, self.poll_seconds, return_when=FIRST_COMPLETED
+                    )
+                    self._collect(done)
+                else:
+                    self._wake.wait(self.poll_seconds)
+                self._wake.clear()
+        finally:
+            if observer is not None:
+                observer.stop()
+                observer.join()
+            # 処理中だったファイルは終わるまで待ち、結果を反映する
+            self._executor.shutdown(wait=True)
+            self._collect(set(self._running), restart=False)
+            _log("監視を終了しました")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="フォルダに置かれた患者データを常駐して変換し続けます"
+    )
+    parser.add_argument("folder", type=pathlib.Path, help="監視するフォルダ")
+    parser.add_argument(
+        "--next-flag",
+        type=int,
+        default=0,
+        help="最終来院日のフィルタリングに使用するタイムオフセット(-1 ~ 1)",
+    )
+    parser.add_argument(
+        "--max-jobs",
+        type=int,
+        default=config.WATCH_MAX_JOBS,
+        help="同時に処理するファイル数",
+    )
+    parser.add_argument(
+        "--poll-seconds",
+        type=float,
+        default=config.WATCH_POLL_SECONDS,
+        help="フォルダを確認する間隔(秒)",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help=f"{config.STREAM_CHUNK_SIZE}行ずつ読み込んで処理し、メモリ使用量を抑える",
+    )
+    parser.add_argument(
+        "--ignore-history",
+        action="store_true",
+        help="郵送履歴で同じ回に送付済みの患者も除外せずに出力する",
+    )
+    parser.add_argument(
+        "--record-history",
+        action="store_true",
+        help="出力した患者を送付済みとして郵送履歴に記録する(next_flagが0の場合だけ)",
+    )
+    args = parser.parse_args()
+
+    watcher = Watcher(
+        args.folder,
+        args.next_flag,
+        args.max_jobs,
+        args.poll_seconds,
+        args.stream,
+        args.ignore_history,
+        args.record_history,
+    )
+    try:
+        watcher.serve()
+    except KeyboardInterrupt:
+        pass
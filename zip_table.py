@@ -0,0 +1,105 @@
+import pathlib
+import pickle
+from typing import Optional
+
+import pandas as pd
+
+import address_cache
+import config
+import postal_number
+
+# 郵便番号が不正(000-0000)な場合と、郵便番号が見つからない場合の値(`postal_number.get_address` と同じ)
+INVALID_ZIP = ("#####", "", "")
+UNKNOWN_ZIP = ("#####郵便番号住所不明", "#####", "#####")
+# 郵便番号から補った町域名の後ろに付ける印(丁目・番地が分からないことを示す)
+FILLED_MARK = "*****"
+
+COLUMNS = ["prefecture", "city", "area"]
+
+
+def build() -> pd.DataFrame:
+    """
+    jushoの住所データから、郵便番号(7桁)→(都道府県, 市区町村, 町域)の表を作る関数。
+
+    1つの郵便番号に複数の町域がある場合は、`postman.by_zip_code` の先頭と同じく
+    jushoのデータで最初の町域を使います。
+    """
+    conn = postal_number.get_postman().conn
+    table = pd.read_sql_query(
+        "SELECT a.zip_code AS zip_code, p.kanji AS prefecture, c.kanji AS city, "
+        "a.kanji AS area FROM addresses AS a "
+        "JOIN cities AS c ON c.id = a.city_id "
+        "JOIN prefectures AS p ON p.id = c.prefecture_id "
+        "ORDER BY a.zip_code, a.id",
+        conn,
+    )
+    return table.drop_duplicates("zip_code").set_index("zip_code")[COLUMNS]
+
+
+def load(path: Optional[str | pathlib.Path] = config.ZIP_TABLE_PATH) -> pd.DataFrame:
+    """
+    郵便番号の表を返す。pathに保存した表がjushoのデータと同じ版であれば読み込み、
+    そうでなければ作り直して保存する(pathがNoneなら保存しない)。
+    """
+    version = address_cache.jusho_data_version()
+    if path is not None:
+        path = pathlib.Path(path)
+        try:
+            with open(path, "rb") as f:
+                saved = pickle.load(f)
+            if saved["version"] == version:
+                return saved["table"]
+        except (OSError, pickle.UnpicklingError, EOFError, KeyError):
+            pass
+    table = build()
+    if path is not None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as f:
+            pickle.dump({"version": version, "table": table}, f)
+    return table
+
+
+_table: Optional[pd.DataFrame] = None
+
+
+def get_table() -> pd.DataFrame:
+    """郵便番号の表を返す。初回呼び出し時に読み込む"""
+    global _table
+    if _table is None:
+        _table = load()
+    return _table
+
+
+def lookup(zip_codes: pd.Series) -> pd.DataFrame:
+    """
+    7桁の郵便番号の列に、都道府県・市区町村・町域を結合して返す関数。
+
+    表にない郵便番号の行は欠損になります。
+
+    Returns:
+        pd.DataFrame: zip_codesと同じインデックスの prefecture, city, area 列
+    """
+    found = get_table().reindex(zip_codes.to_numpy())
+    found.index = zip_codes.index
+    return found
+
+
+def fill_values(zip_codes: pd.Series, found: pd.DataFrame) -> pd.DataFrame:
+    """
+    住所が空欄の行に入れる値を、`postal_number.get_address` と同じ形式で返す関数。
+
+    町域名の後ろには `FILLED_MARK` を付け、不正な郵便番号・見つからない郵便番号の行には
+    それぞれ `INVALID_ZIP`・`UNKNOWN_ZIP` を入れます。
+
+    Args:
+        zip_codes (pd.Series): 7桁の郵便番号の列
+        found (pd.DataFrame): zip_codesを `lookup` した結果
+    """
+    filled = found.copy()
+    filled["area"] = filled["area"] + FILLED_MARK
+    unknown = filled["prefecture"].isna()
+    invalid = zip_codes == "0000000"
+    for column, unknown_value, invalid_value in zip(COLUMNS, UNKNOWN_ZIP, INVALID_ZIP):
+        filled.loc[unknown, column] = unknown_value
+        filled.loc[invalid, column] = invalid_value
+    return filled